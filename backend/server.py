@@ -1,20 +1,46 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, Request, Response, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel, ReturnDocument, UpdateOne, monitoring
+from pymongo import timeout as mongo_timeout
+from pymongo.errors import (
+    BulkWriteError, DuplicateKeyError, ExecutionTimeout, NetworkTimeout, PyMongoError,
+    ServerSelectionTimeoutError, WaitQueueTimeoutError,
+)
+from bson import ObjectId
+from bson.errors import InvalidId
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
 import os
+import asyncio
+import gzip
+import json
+import base64
+import hashlib
+import functools
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional
+from typing import Dict, List, Optional
 import uuid
+from bisect import bisect_left, bisect_right
+from types import MappingProxyType
 from datetime import datetime, timedelta
 from passlib.context import CryptContext
 import jwt
 from jwt.exceptions import InvalidTokenError
+import brotli
+from sortedcontainers import SortedList
 import random
-
+import time
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -27,12 +53,548 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
+
+# Instrumentation des commandes MongoDB
+# Un CommandListener pymongo chronomètre chaque commande. Motor exécute pymongo dans
+# des threads en copiant le contexte : la ContextVar posée par le middleware de
+# métriques permet d'attribuer la commande à la requête HTTP en cours (nombre de
+# commandes par requête, par route). Les commandes plus lentes que
+# MONGO_SLOW_COMMAND_MS sont journalisées avec la forme de leur filtre (valeurs
+# masquées) et, si MONGO_SLOW_COMMAND_EXPLAIN=true, le plan retenu par explain().
+MONGO_COMMAND_MONITORING = os.environ.get('MONGO_COMMAND_MONITORING', 'true').lower() == 'true'
+MONGO_SLOW_COMMAND_MS = float(os.environ.get('MONGO_SLOW_COMMAND_MS', 100))
+MONGO_SLOW_COMMAND_EXPLAIN = os.environ.get('MONGO_SLOW_COMMAND_EXPLAIN', 'false').lower() == 'true'
+MONGO_SLOW_EXPLAIN_INTERVAL_SECONDS = 5
+MONGO_COMMANDS_PER_REQUEST_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+MONGO_POOL_WAIT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+MONGO_FILTER_FIELDS = {
+    "find": "filter", "count": "query", "distinct": "query", "findAndModify": "query",
+}
+MONGO_EXPLAINABLE_COMMANDS = ("find", "aggregate", "count", "distinct", "findAndModify", "update", "delete")
+MONGO_EXPLAIN_DROPPED_FIELDS = ("lsid", "txnNumber", "autocommit", "startTransaction", "writeConcern", "readConcern")
+
+mongo_request_context: ContextVar[Optional[dict]] = ContextVar("mongo_request_context", default=None)
+
+def query_shape(value):
+    """Filtre -> même structure avec les valeurs remplacées par "?" (pas de données dans les logs)"""
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, list) and value and all(isinstance(item, dict) for item in value):
+        return [query_shape(item) for item in value]
+    return "?"
+
+def command_filter(command_name: str, command: dict):
+    if command_name in MONGO_FILTER_FIELDS:
+        return command.get(MONGO_FILTER_FIELDS[command_name])
+    if command_name == "aggregate":
+        return [
+            {stage: spec if stage == "$match" else "?"}
+            for stage_doc in command.get("pipeline", [])
+            for stage, spec in stage_doc.items()
+        ]
+    if command_name in ("update", "delete"):
+        statements = command.get(f"{command_name}s") or [{}]
+        return statements[0].get("q")
+    return None
+
+class MongoCommandMetrics:
+    """Latence par (collection, commande) et commandes par requête HTTP.
+
+    Alimenté depuis les threads de Motor : toutes les écritures passent par un verrou.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency: Dict[tuple, "Histogram"] = {}
+        self.failures: Dict[tuple, int] = {}
+        self.route_commands: Dict[tuple, int] = {}
+        self.per_request: Dict[str, "Histogram"] = {}
+        self.pool_wait: Dict[str, "Histogram"] = {}
+        self.pool_checkout_failures: Dict[str, int] = {}
+        self.pool_connections = 0
+        self.pool_checked_out = 0
+        self.slow_commands = deque(maxlen=100)
+    
+    def record(self, route: str, collection: str, command_name: str, duration: float, failed: bool):
+        key = (collection, command_name)
+        with self.lock:
+            histogram = self.latency.get(key)
+            if histogram is None:
+                histogram = self.latency[key] = Histogram(METRICS_LATENCY_BUCKETS)
+            histogram.observe(duration)
+            if failed:
+                self.failures[key] = self.failures.get(key, 0) + 1
+            route_key = (route, collection, command_name)
+            self.route_commands[route_key] = self.route_commands.get(route_key, 0) + 1
+    
+    def record_request(self, route: str, commands: int):
+        with self.lock:
+            histogram = self.per_request.get(route)
+            if histogram is None:
+                histogram = self.per_request[route] = Histogram(MONGO_COMMANDS_PER_REQUEST_BUCKETS)
+            histogram.observe(commands)
+    
+    def record_pool_wait(self, route: str, duration: float, failure_reason: Optional[str] = None):
+        with self.lock:
+            histogram = self.pool_wait.get(route)
+            if histogram is None:
+                histogram = self.pool_wait[route] = Histogram(MONGO_POOL_WAIT_BUCKETS)
+            histogram.observe(duration)
+            if failure_reason is None:
+                self.pool_checked_out += 1
+            else:
+                self.pool_checkout_failures[failure_reason] = self.pool_checkout_failures.get(failure_reason, 0) + 1
+    
+    def render(self) -> str:
+        with self.lock:
+            lines = [
+                "# HELP mongo_pool_connections Open connections in the MongoDB pool.",
+                "# TYPE mongo_pool_connections gauge",
+                f"mongo_pool_connections {self.pool_connections}",
+                "# HELP mongo_pool_checked_out Connections currently checked out of the pool.",
+                "# TYPE mongo_pool_checked_out gauge",
+                f"mongo_pool_checked_out {self.pool_checked_out}",
+                "# HELP mongo_pool_checkout_failures_total Failed pool checkouts, by reason.",
+                "# TYPE mongo_pool_checkout_failures_total counter",
+                *(f'mongo_pool_checkout_failures_total{{reason="{reason}"}} {total}'
+                  for reason, total in sorted(self.pool_checkout_failures.items())),
+                "# HELP mongo_commands_total MongoDB commands, by HTTP route, collection and command.",
+                "# TYPE mongo_commands_total counter",
+            ]
+            for (route, collection, command_name), total in sorted(self.route_commands.items()):
+                lines.append(f'mongo_commands_total{{route="{route}",collection="{collection}",command="{command_name}"}} {total}')
+            lines.append("# HELP mongo_command_failures_total Failed MongoDB commands.")
+            lines.append("# TYPE mongo_command_failures_total counter")
+            for (collection, command_name), total in sorted(self.failures.items()):
+                lines.append(f'mongo_command_failures_total{{collection="{collection}",command="{command_name}"}} {total}')
+            histograms = (
+                ("mongo_command_duration_seconds", "MongoDB command latency in seconds.", {
+                    f'collection="{collection}",command="{command_name}"': histogram
+                    for (collection, command_name), histogram in sorted(self.latency.items())
+                }),
+                ("mongo_commands_per_request", "MongoDB commands issued per HTTP request.", {
+                    f'route="{route}"': histogram for route, histogram in sorted(self.per_request.items())
+                }),
+                ("mongo_pool_wait_seconds", "Time spent waiting for a pooled connection.", {
+                    f'route="{route}"': histogram for route, histogram in sorted(self.pool_wait.items())
+                }),
+            )
+            for name, help_text, series in histograms:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in series.items():
+                    for bound, running in histogram.cumulative():
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f'{name}_bucket{{{labels},le="{le}"}} {running}')
+                    lines.append(f"{name}_sum{{{labels}}} {histogram.total}")
+                    lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+mongo_command_metrics = MongoCommandMetrics()
+
+class MongoCommandListener(monitoring.CommandListener):
+    def __init__(self, metrics: MongoCommandMetrics):
+        self.metrics = metrics
+        self.started_commands: Dict[tuple, tuple] = {}
+    
+    def started(self, event):
+        command = event.command
+        collection = command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = "admin" if event.command_name != "getMore" else command.get("collection", "-")
+        context = mongo_request_context.get()
+        if context is not None:
+            with self.metrics.lock:
+                context["commands"] += 1
+        route = current_mongo_route()
+        self.started_commands[(event.connection_id, event.request_id)] = (route, collection, command)
+    
+    def finished(self, event, failed: bool):
+        started = self.started_commands.pop((event.connection_id, event.request_id), None)
+        if started is None:
+            return
+        route, collection, command = started
+        duration = event.duration_micros / 1e6
+        self.metrics.record(route, collection, event.command_name, duration, failed)
+        if duration * 1000 >= MONGO_SLOW_COMMAND_MS and event.command_name in MONGO_EXPLAINABLE_COMMANDS:
+            logger.warning(
+                "Commande MongoDB lente (%.1f ms) %s.%s route=%s filtre=%s",
+                duration * 1000, collection, event.command_name, route,
+                json.dumps(query_shape(command_filter(event.command_name, command)), default=str)
+            )
+            if MONGO_SLOW_COMMAND_EXPLAIN:
+                self.metrics.slow_commands.append((event.database_name, {
+                    key: value for key, value in command.items()
+                    if not key.startswith("$") and key not in MONGO_EXPLAIN_DROPPED_FIELDS
+                }))
+    
+    def succeeded(self, event):
+        self.finished(event, failed=False)
+    
+    def failed(self, event):
+        self.finished(event, failed=True)
+
+def current_mongo_route() -> str:
+    context = mongo_request_context.get()
+    if context is None:
+        return "background"
+    return getattr(context["scope"].get("route"), "path", METRICS_UNMATCHED_ROUTE)
+
+class MongoPoolListener(monitoring.ConnectionPoolListener):
+    """Temps d'attente d'une connexion du pool (début et fin du checkout dans le même thread)"""
+    
+    def __init__(self, metrics: MongoCommandMetrics):
+        self.metrics = metrics
+        self.checkouts = threading.local()
+    
+    def connection_check_out_started(self, event):
+        self.checkouts.started = time.perf_counter()
+    
+    def checkout_finished(self, failure_reason: Optional[str] = None):
+        started = getattr(self.checkouts, "started", None)
+        if started is None:
+            return
+        self.checkouts.started = None
+        self.metrics.record_pool_wait(current_mongo_route(), time.perf_counter() - started, failure_reason)
+    
+    def connection_checked_out(self, event):
+        self.checkout_finished()
+    
+    def connection_check_out_failed(self, event):
+        self.checkout_finished(str(event.reason))
+    
+    def connection_checked_in(self, event):
+        with self.metrics.lock:
+            self.metrics.pool_checked_out -= 1
+    
+    def connection_created(self, event):
+        with self.metrics.lock:
+            self.metrics.pool_connections += 1
+    
+    def connection_closed(self, event):
+        with self.metrics.lock:
+            self.metrics.pool_connections -= 1
+    
+    def connection_ready(self, event):
+        pass
+    
+    def pool_created(self, event):
+        pass
+    
+    def pool_ready(self, event):
+        pass
+    
+    def pool_cleared(self, event):
+        pass
+    
+    def pool_closed(self, event):
+        pass
+
+async def run_slow_command_explain():
+    """Journalise le plan (explain queryPlanner) des commandes lentes signalées par le listener"""
+    while True:
+        await asyncio.sleep(MONGO_SLOW_EXPLAIN_INTERVAL_SECONDS)
+        while mongo_command_metrics.slow_commands:
+            database_name, command = mongo_command_metrics.slow_commands.popleft()
+            try:
+                explain = await client[database_name].command({"explain": command, "verbosity": "queryPlanner"})
+            except PyMongoError:
+                logger.exception("explain() impossible pour une commande lente")
+                continue
+            logger.warning(
+                "Plan de la commande lente %s : %s",
+                json.dumps(query_shape(command_filter(next(iter(command)), command)), default=str),
+                json.dumps(explain.get("queryPlanner", {}).get("winningPlan", {}), default=str)
+            )
 
 # MongoDB connection
+# Pool et délais réglables. MONGO_TIMEOUT_MS est le budget par défaut de chaque
+# opération (timeoutMS : le pilote envoie le maxTimeMS restant au serveur) ; une
+# route peut le remplacer avec @mongo_time_budget. Ce budget couvre aussi l'attente
+# d'une connexion du pool : avec timeoutMS, pymongo ignore waitQueueTimeoutMS, qui
+# n'est donc pas configuré. Les tâches de fond et les scripts d'administration
+# tournent sans budget (mongo_timeout(0)) et attendent une connexion sans limite.
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', 100))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', 10))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000))
+MONGO_TIMEOUT_MS = int(os.environ.get('MONGO_TIMEOUT_MS', 2000))
+MONGO_BULK_TIMEOUT_MS = int(os.environ.get('MONGO_BULK_TIMEOUT_MS', 15000))
+MONGO_TIMEOUT_ERRORS = (ExecutionTimeout, NetworkTimeout, ServerSelectionTimeoutError, WaitQueueTimeoutError)
+
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(
+    mongo_url,
+    maxPoolSize=MONGO_MAX_POOL_SIZE,
+    minPoolSize=MONGO_MIN_POOL_SIZE,
+    serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    timeoutMS=MONGO_TIMEOUT_MS or None,
+    event_listeners=[
+        MongoCommandListener(mongo_command_metrics),
+        MongoPoolListener(mongo_command_metrics),
+    ] if MONGO_COMMAND_MONITORING else []
+)
 db = client[os.environ['DB_NAME']]
 
+def mongo_time_budget(timeout_ms: int):
+    """Remplace le budget MongoDB par défaut pour toute une route (0 = illimité)"""
+    def decorator(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            with mongo_timeout(timeout_ms / 1000):
+                return await endpoint(*args, **kwargs)
+        return wrapper
+    return decorator
+
+async def prewarm_mongo_pool():
+    """Ouvre MONGO_MIN_POOL_SIZE connexions avant la première requête"""
+    try:
+        await asyncio.gather(*(client.admin.command("ping") for _ in range(MONGO_MIN_POOL_SIZE)))
+    except PyMongoError:
+        logger.warning("Préchauffage du pool MongoDB impossible", exc_info=True)
+
+# In-process caches
+class TTLCache:
+    """Cache LRU en mémoire avec expiration (TTL) et version par clé.
+
+    La version d'une clé change à chaque invalidation : un chargement commencé
+    avant une écriture (version lue avant la requête Mongo) n'est pas stocké
+    s'il se termine après l'invalidation, ce qui évite de remettre en cache une
+    valeur périmée.
+
+    Avec field, la valeur d'une clé est un dict de variantes (projections, stats...)
+    qui partagent la version, l'expiration et l'invalidation de la clé.
+    """
+
+    def __init__(self, maxsize: int, ttl_seconds: float):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # clé -> (expire_at, valeur)
+        self._versions = {}
+        self._clock = count(1)
+        self._version_floor = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def version(self, key) -> int:
+        return self._versions.get(key, self._version_floor)
+
+    def _live_entry(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] <= time.monotonic():
+            del self._entries[key]
+            return None
+        return entry
+
+    def get(self, key, field=None):
+        entry = self._live_entry(key)
+        if entry is None or (field is not None and field not in entry[1]):
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1] if field is None else entry[1][field]
+
+    def put(self, key, value, version: Optional[int] = None, field=None):
+        if version is not None and version != self.version(key):
+            return
+        expires_at = time.monotonic() + self.ttl_seconds
+        if field is not None:
+            # Ajout d'une variante : l'expiration de la clé n'est pas prolongée
+            entry = self._live_entry(key)
+            if entry is not None:
+                expires_at = entry[0]
+            value = {**(entry[1] if entry is not None else {}), field: value}
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+        self._versions[key] = next(self._clock)
+        self.invalidations += 1
+        if len(self._versions) > 4 * self.maxsize:
+            # Oublier les versions individuelles : tout chargement en cours
+            # devient périmé, ce qui est sans danger (simple absence de cache)
+            self._versions.clear()
+            self._version_floor = next(self._clock)
+
+    def clear(self):
+        self._entries.clear()
+        self._versions.clear()
+        self._version_floor = next(self._clock)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+# Utilisateurs authentifiés (UserView), indexés par username puis par projection
+user_cache = TTLCache(
+    maxsize=int(os.environ.get('USER_CACHE_MAX_SIZE', 10000)),
+    ttl_seconds=float(os.environ.get('USER_CACHE_TTL_SECONDS', 30)),
+)
+
+# Composition des clubs (club + profils des membres), indexée par club id
+club_roster_cache = TTLCache(
+    maxsize=int(os.environ.get('CLUB_ROSTER_CACHE_MAX_SIZE', 2000)),
+    ttl_seconds=float(os.environ.get('CLUB_ROSTER_CACHE_TTL_SECONDS', 10)),
+)
+
+# Classements entre amis, indexés par username puis par stat
+friends_leaderboard_cache = TTLCache(
+    maxsize=int(os.environ.get('FRIENDS_LEADERBOARD_CACHE_MAX_SIZE', 10000)),
+    ttl_seconds=float(os.environ.get('FRIENDS_LEADERBOARD_CACHE_TTL_SECONDS', 15)),
+)
+
+# Transactions MongoDB (nécessitent un replica set)
+MONGO_TRANSACTIONS = os.environ.get('MONGO_TRANSACTIONS', 'false').lower() == 'true'
+
+@asynccontextmanager
+async def mongo_transaction():
+    """Session transactionnelle si MONGO_TRANSACTIONS est activé, sinon None (écritures indépendantes)"""
+    if not MONGO_TRANSACTIONS:
+        yield None
+        return
+    async with await client.start_session() as session:
+        async with session.start_transaction():
+            yield session
+
+STAT_NAMES = ("travail", "sport", "creation", "lecture", "adaptabilite")
+
+# MongoDB indexes (créés au démarrage, idempotents)
+MONGO_INDEXES = {
+    "users": [
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        IndexModel([("username_lower", ASCENDING), ("username", ASCENDING)], name="username_lower_username"),
+        IndexModel([("username_trigrams", ASCENDING)], name="username_trigrams"),
+        IndexModel([("club_id", ASCENDING)], name="club_id", sparse=True),
+        # Comptes pas encore migrés vers attack_inventory (vide une fois la migration faite)
+        IndexModel([("attacks", ASCENDING)], name="legacy_attacks", sparse=True),
+        # Classements par stat (ELO décroissant, départage par username)
+        *[
+            IndexModel([(f"stats.{stat_name}.elo", DESCENDING), ("username", ASCENDING)], name=f"elo_{stat_name}")
+            for stat_name in STAT_NAMES
+        ],
+    ],
+    "attack_actions": [
+        IndexModel(
+            [("target", ASCENDING), ("applied", ASCENDING), ("_id", ASCENDING)],
+            name="target_applied_id",
+        ),
+        IndexModel([("apply_batch", ASCENDING)], name="apply_batch", sparse=True),
+        # Lots réservés dont l'écriture sur le joueur n'est pas confirmée (rejoués)
+        IndexModel(
+            [("target", ASCENDING), ("_id", ASCENDING)],
+            name="unwritten_target_id",
+            partialFilterExpression={"apply_pending": True},
+        ),
+        IndexModel(
+            [("applied_at", ASCENDING)],
+            name="unwritten_applied_at",
+            partialFilterExpression={"apply_pending": True},
+        ),
+        # Parcours des cibles par la résolution de minuit (attaques non appliquées uniquement)
+        IndexModel(
+            [("target", ASCENDING), ("_id", ASCENDING)],
+            name="pending_target_id",
+            partialFilterExpression={"applied": False},
+        ),
+    ],
+    "club_stats": [
+        IndexModel([("total_level", DESCENDING), ("_id", ASCENDING)], name="total_level"),
+        IndexModel([("active_members", DESCENDING), ("_id", ASCENDING)], name="active_members"),
+        IndexModel([("member_count", DESCENDING), ("_id", ASCENDING)], name="member_count"),
+        *[
+            IndexModel([(f"mean_elo.{stat_name}", DESCENDING), ("_id", ASCENDING)], name=f"mean_elo_{stat_name}")
+            for stat_name in STAT_NAMES
+        ],
+    ],
+    "active_effects": [
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+        IndexModel(
+            [("effect_type", ASCENDING), ("tick_slot", ASCENDING)],
+            name="recurring_tick_slot",
+            partialFilterExpression={"ticks_left": {"$gt": 0}},
+        ),
+        IndexModel([("tick_batch", ASCENDING)], name="tick_batch", sparse=True),
+        IndexModel([("apply_batch", ASCENDING)], name="apply_batch", sparse=True),
+    ],
+    "clubs": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("name", ASCENDING)], name="name_unique", unique=True),
+        IndexModel([("name_lower", ASCENDING)], name="name_lower"),
+        IndexModel([("member_count", DESCENDING), ("id", ASCENDING)], name="member_count_id"),
+        IndexModel(
+            [("name", TEXT), ("description", TEXT)],
+            name="name_description_text",
+            default_language="french",
+            weights={"name": 10, "description": 1},
+        ),
+    ],
+}
+
+# Formes de requêtes utilisées par les routes : (collection, filtre, tri).
+# verify_indexes.py exécute explain() sur chacune et échoue en cas de COLLSCAN.
+MONGO_QUERY_SHAPES = [
+    ("club_stats", {}, [("total_level", DESCENDING), ("_id", ASCENDING)]),
+    ("users", {"club_id": {"$in": ["club-id"]}}, None),
+    ("users", {}, [("stats.travail.elo", DESCENDING), ("username", ASCENDING)]),
+    ("users", {"$or": [{"stats.travail.elo": {"$gt": 1200}}, {"stats.travail.elo": 1200, "username": {"$lt": "lapin"}}]}, None),
+    ("users", {"$or": [{"stats.travail.elo": {"$gt": 1200}}, {"stats.travail.elo": 1200, "username": {"$lt": "lapin"}}]}, [("stats.travail.elo", ASCENDING), ("username", DESCENDING)]),
+    ("users", {"$or": [{"stats.travail.elo": {"$lt": 1200}}, {"stats.travail.elo": 1200, "username": {"$gt": "lapin"}}]}, [("stats.travail.elo", DESCENDING), ("username", ASCENDING)]),
+    ("users", {"username": "lapin"}, None),
+    ("users", {"$or": [{"username": "lapin"}, {"email": "lapin@example.com"}]}, None),
+    ("users", {"username": {"$in": ["lapin", "lievre"]}}, None),
+    ("users", {"username_lower": {"$gte": "lap", "$lt": "lap\U0010ffff"}}, [("username_lower", ASCENDING), ("username", ASCENDING)]),
+    ("users", {"username_trigrams": {"$in": ["  l", " la", "lap"]}}, None),
+    ("users", {"username_lower": {"$exists": False}}, None),
+    ("users", {"attacks": {"$exists": True}}, None),
+    ("attack_actions", {"target": "lapin", "applied": False}, [("_id", ASCENDING)]),
+    ("attack_actions", {"apply_batch": "batch-id"}, None),
+    ("attack_actions", {"target": "lapin", "apply_pending": True}, [("_id", ASCENDING)]),
+    ("attack_actions", {"applied_at": {"$lt": datetime(2024, 1, 1)}, "apply_pending": True}, [("_id", ASCENDING)]),
+    ("attack_actions", {"applied": False, "_id": {"$lt": ObjectId()}}, [("target", ASCENDING)]),
+    ("active_effects", {"effect_type": "elo_poison", "ticks_left": {"$gt": 0}, "tick_slot": {"$lte": 0}}, None),
+    ("active_effects", {"tick_batch": "batch-id"}, None),
+    ("clubs", {"id": "club-id"}, None),
+    ("clubs", {"name": "Club"}, None),
+    ("clubs", {"$or": [
+        {"name_lower": {"$gte": "clu", "$lt": "clu\U0010ffff"}},
+        {"$text": {"$search": "clu"}},
+    ]}, None),
+    ("clubs", {}, [("member_count", DESCENDING), ("id", ASCENDING)]),
+    ("clubs", {"name_lower": {"$exists": False}}, None),
+]
+
+async def ensure_indexes():
+    """Crée les index déclarés dans MONGO_INDEXES (sans effet s'ils existent déjà).
+
+    Chaque index est créé séparément : un échec (doublons existants pour un index
+    unique, options modifiées) n'empêche pas les autres d'être créés. Le démarrage
+    échoue ensuite, les index uniques garantissant l'intégrité des inscriptions et des clubs.
+    """
+    failed = []
+    for collection_name, indexes in MONGO_INDEXES.items():
+        for index in indexes:
+            try:
+                await db[collection_name].create_indexes([index])
+            except PyMongoError:
+                logger.exception("Création de l'index %s.%s impossible", collection_name, index.document["name"])
+                failed.append(f"{collection_name}.{index.document['name']}")
+    if failed:
+        raise RuntimeError(f"Index MongoDB non créés : {', '.join(failed)}")
+
 # Static game data
 ATTACKS_DATA = [
     {"id": 1, "name": "Frappe éclair", "description": "Une attaque rapide qui réduit temporairement une stat ciblée", "effect_type": "stat_reduce", "effect_value": 10, "duration_hours": 24},
@@ -131,12 +693,300 @@ SPECIAL_TITLES_DATA = [
     {"id": "marathonien", "name": "Marathonien", "description": "Terminer 500 missions cumulées (toutes catégories)", "condition": "total_missions", "required_count": 500, "icon": "🏃‍♂️"}
 ]
 
+# Game catalog indexes (construits une seule fois à l'import, en lecture seule)
+ATTACKS_BY_ID = MappingProxyType({attack["id"]: attack for attack in ATTACKS_DATA})
+ATTACK_IDS = tuple(ATTACKS_BY_ID)
+
+TITLES_SORTED = tuple(sorted(TITLES_DATA, key=lambda title: title["level_required"]))
+TITLE_THRESHOLDS = tuple(title["level_required"] for title in TITLES_SORTED)
+TITLES_BY_NAME = MappingProxyType({title["name"]: title for title in TITLES_DATA})
+
+
+def get_attack(attack_id: int) -> Optional[dict]:
+    """Retourne l'attaque du catalogue correspondant à l'id, ou None"""
+    return ATTACKS_BY_ID.get(attack_id)
+
+def get_title(title_name: str) -> Optional[dict]:
+    """Retourne le titre de progression correspondant au nom, ou None"""
+    return TITLES_BY_NAME.get(title_name)
+
+def count_unlocked_titles(total_level: int) -> int:
+    """Nombre de titres de progression débloqués pour un niveau total (recherche dichotomique)"""
+    return bisect_right(TITLE_THRESHOLDS, total_level)
+
+# Pre-serialized static catalog responses
+CATALOG_CACHE_CONTROL = "public, max-age=3600"
+
+class PrecompressedJSON:
+    """Payload JSON statique encodé une seule fois, avec variantes gzip/brotli et ETag fort"""
+
+    def __init__(self, content):
+        body = json.dumps(
+            jsonable_encoder(content),
+            ensure_ascii=False,
+            allow_nan=False,
+            separators=(",", ":"),
+        ).encode("utf-8")
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.bodies = {
+            "identity": body,
+            "gzip": gzip.compress(body, compresslevel=9, mtime=0),
+            "br": brotli.compress(body, quality=11),
+        }
+        # Un ETag fort distinct par encodage, comme l'exige la RFC 9110
+        self.etags = {
+            encoding: f'"{digest}"' if encoding == "identity" else f'"{digest}-{encoding}"'
+            for encoding in self.bodies
+        }
+
+    def negotiate(self, accept_encoding: str) -> str:
+        accepted = {}
+        for part in accept_encoding.split(","):
+            coding, _, params = part.strip().partition(";")
+            quality = 1.0
+            params = params.strip()
+            if params.startswith("q="):
+                try:
+                    quality = float(params[2:])
+                except ValueError:
+                    quality = 0.0
+            if coding:
+                accepted[coding.strip().lower()] = quality
+        for encoding in ("br", "gzip"):
+            if encoding in self.bodies and accepted.get(encoding, accepted.get("*", 0)) > 0:
+                return encoding
+        return "identity"
+
+    def matches(self, if_none_match: str) -> bool:
+        if if_none_match.strip() == "*":
+            return True
+        # Comparaison faible pour If-None-Match : on ignore le préfixe W/
+        candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return not candidates.isdisjoint(self.etags.values())
+
+    def response(self, request: Request) -> Response:
+        encoding = self.negotiate(request.headers.get("accept-encoding", ""))
+        headers = {
+            "ETag": self.etags[encoding],
+            "Cache-Control": CATALOG_CACHE_CONTROL,
+            "Vary": "Accept-Encoding",
+        }
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and self.matches(if_none_match):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(content=self.bodies[encoding], media_type="application/json", headers=headers)
+
+ATTACKS_PAYLOAD = PrecompressedJSON(ATTACKS_DATA)
+DEFENSES_PAYLOAD = PrecompressedJSON(DEFENSES_DATA)
+TITLES_PAYLOAD = PrecompressedJSON(TITLES_DATA)
+SPECIAL_TITLES_PAYLOAD = PrecompressedJSON(SPECIAL_TITLES_DATA)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Index et tâches de fond : pas de budget par opération (les tâches copient ce contexte)
+    with mongo_timeout(0):
+        await asyncio.gather(ensure_indexes(), prewarm_mongo_pool())
+        background_tasks = [
+            asyncio.create_task(backfill_user_search_fields()),
+            asyncio.create_task(backfill_club_search_fields()),
+            asyncio.create_task(backfill_attack_inventory()),
+            asyncio.create_task(run_leaderboard_refresh()),
+            asyncio.create_task(run_leaderboard_rebuilds()),
+            asyncio.create_task(run_club_stats_refresh()),
+            asyncio.create_task(run_presence_flush()),
+        ]
+        if ATTACK_RESOLVER_ENABLED:
+            background_tasks.append(asyncio.create_task(run_attack_resolver()))
+        if TIMED_EFFECTS_ENABLED:
+            background_tasks.append(asyncio.create_task(run_timed_effects_scheduler()))
+        if ATTACK_EVENTS_CHANGE_STREAM:
+            background_tasks.append(asyncio.create_task(run_attack_event_stream()))
+        if MONGO_COMMAND_MONITORING and MONGO_SLOW_COMMAND_EXPLAIN:
+            background_tasks.append(asyncio.create_task(run_slow_command_explain()))
+    yield
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    try:
+        await flush_presence()
+    except PyMongoError:
+        logger.exception("Écriture de la présence impossible")
+    client.close()
+
+# Métriques HTTP (format texte Prometheus, GET /api/metrics)
+# Middleware ASGI pur : pas de BaseHTTPMiddleware ni de tâche par requête, juste
+# quelques incréments dans des histogrammes à bornes fixes (bisection sur une
+# dizaine de bornes). Les routes sont étiquetées par leur gabarit
+# (scope["route"].path) pour que la cardinalité reste bornée. Compteurs par processus.
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS_SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+METRICS_QUANTILES = (0.5, 0.95, 0.99)
+METRICS_UNMATCHED_ROUTE = "unmatched"
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "total", "count")
+    
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # dernière case : +Inf
+        self.total = 0.0
+        self.count = 0
+    
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+    
+    def cumulative(self):
+        running = 0
+        for bound, bucket_count in zip((*self.bounds, float("inf")), self.counts):
+            running += bucket_count
+            yield bound, running
+    
+    def quantile(self, q: float) -> float:
+        """Estimation par interpolation linéaire dans la case (comme histogram_quantile)"""
+        if not self.count:
+            return float("nan")
+        rank = q * self.count
+        lower, below = 0.0, 0
+        for bound, running in self.cumulative():
+            if running >= rank:
+                if bound == float("inf"):
+                    return lower
+                in_bucket = running - below
+                return lower + (bound - lower) * (rank - below) / in_bucket if in_bucket else bound
+            lower, below = bound, running
+        return lower
+
+class RouteMetrics:
+    __slots__ = ("statuses", "latency", "size")
+    
+    def __init__(self):
+        self.statuses: Dict[int, int] = {}
+        self.latency = Histogram(METRICS_LATENCY_BUCKETS)
+        self.size = Histogram(METRICS_SIZE_BUCKETS)
+
+class RequestMetrics:
+    def __init__(self):
+        self.routes: Dict[tuple, RouteMetrics] = {}
+        self.in_flight = 0
+    
+    def record(self, method: str, route: str, status_code: int, duration: float, size: int):
+        metrics = self.routes.get((method, route))
+        if metrics is None:
+            metrics = self.routes[(method, route)] = RouteMetrics()
+        metrics.statuses[status_code] = metrics.statuses.get(status_code, 0) + 1
+        metrics.latency.observe(duration)
+        metrics.size.observe(size)
+    
+    def render(self) -> str:
+        """Exposition au format texte Prometheus 0.0.4"""
+        routes = sorted(self.routes.items())
+        lines = [
+            "# HELP http_requests_in_flight Requests currently being served.",
+            "# TYPE http_requests_in_flight gauge",
+            f"http_requests_in_flight {self.in_flight}",
+            "# HELP http_requests_total Requests served, by route template and status code.",
+            "# TYPE http_requests_total counter",
+        ]
+        for (method, route), metrics in routes:
+            for status_code, total in sorted(metrics.statuses.items()):
+                lines.append(f'http_requests_total{{method="{method}",route="{route}",status="{status_code}"}} {total}')
+        
+        for name, unit_help, attribute in (
+            ("http_request_duration_seconds", "Request latency in seconds (time to first byte for event streams).", "latency"),
+            ("http_response_size_bytes", "Response body size in bytes.", "size"),
+        ):
+            lines.append(f"# HELP {name} {unit_help}")
+            lines.append(f"# TYPE {name} histogram")
+            for (method, route), metrics in routes:
+                histogram = getattr(metrics, attribute)
+                labels = f'method="{method}",route="{route}"'
+                for bound, running in histogram.cumulative():
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'{name}_bucket{{{labels},le="{le}"}} {running}')
+                lines.append(f"{name}_sum{{{labels}}} {histogram.total}")
+                lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+        
+        lines.append("# HELP http_request_duration_quantile_seconds Latency quantiles estimated from the histogram.")
+        lines.append("# TYPE http_request_duration_quantile_seconds gauge")
+        for (method, route), metrics in routes:
+            for q in METRICS_QUANTILES:
+                lines.append(
+                    f'http_request_duration_quantile_seconds{{method="{method}",route="{route}",quantile="{q}"}} '
+                    f"{metrics.latency.quantile(q)}"
+                )
+        return "\n".join(lines) + "\n"
+
+request_metrics = RequestMetrics()
+
+class RequestMetricsMiddleware:
+    def __init__(self, app, metrics: RequestMetrics):
+        self.app = app
+        self.metrics = metrics
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        response = {"status": 500, "size": 0, "recorded": False}
+        start = time.perf_counter()
+        
+        def route_path():
+            return getattr(scope.get("route"), "path", METRICS_UNMATCHED_ROUTE)
+        
+        def finish(size: int):
+            """Enregistre la requête une seule fois et la sort de la jauge in-flight"""
+            response["recorded"] = True
+            self.metrics.in_flight -= 1
+            self.metrics.record(scope["method"], route_path(), response["status"], time.perf_counter() - start, size)
+        
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                # Flux SSE : on mesure le temps jusqu'au premier octet, pas la durée de la connexion
+                if any(
+                    name == b"content-type" and value.startswith(b"text/event-stream")
+                    for name, value in message.get("headers", ())
+                ):
+                    finish(0)
+            elif message["type"] == "http.response.body":
+                response["size"] += len(message.get("body", b""))
+            await send(message)
+        
+        mongo_context = {"scope": scope, "commands": 0}
+        context_token = mongo_request_context.set(mongo_context)
+        self.metrics.in_flight += 1
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            mongo_request_context.reset(context_token)
+            if not response["recorded"]:
+                finish(response["size"])
+            if MONGO_COMMAND_MONITORING:
+                mongo_command_metrics.record_request(route_path(), mongo_context["commands"])
+
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
+async def mongo_timeout_handler(request: Request, exc: PyMongoError):
+    """Budget MongoDB dépassé ou pool saturé : 503 plutôt qu'une requête qui traîne"""
+    logger.warning("Délai MongoDB dépassé sur %s : %s", request.url.path, exc)
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Service temporairement surchargé, veuillez réessayer"},
+        headers={"Retry-After": "1"}
+    )
+
+for timeout_error in MONGO_TIMEOUT_ERRORS:
+    app.add_exception_handler(timeout_error, mongo_timeout_handler)
+
 # Authentication functions
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -144,6 +994,80 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+class PasswordHasher:
+    """Exécute bcrypt hors de la boucle d'événements, avec une concurrence bornée.
+
+    bcrypt libère le GIL pendant le calcul : un pool de threads dédié suffit à
+    garder la boucle disponible pendant une rafale de connexions. Au-delà de
+    max_queue requêtes en attente, on répond 503 plutôt que d'accumuler.
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="password-hash")
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.waiting = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.total_run_seconds = 0.0
+
+    async def run(self, fn, *args):
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Serveur occupé, réessayez dans un instant",
+                headers={"Retry-After": "1"},
+            )
+        
+        enqueued_at = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        
+        started_at = time.perf_counter()
+        wait = started_at - enqueued_at
+        self.total_wait_seconds += wait
+        self.max_wait_seconds = max(self.max_wait_seconds, wait)
+        self.in_flight += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self.total_run_seconds += time.perf_counter() - started_at
+            self._semaphore.release()
+
+    async def verify(self, plain_password, hashed_password) -> bool:
+        return await self.run(verify_password, plain_password, hashed_password)
+
+    async def hash(self, password) -> str:
+        return await self.run(get_password_hash, password)
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "waiting": self.waiting,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "mean_wait_ms": round(self.total_wait_seconds * 1000 / self.completed, 3) if self.completed else 0.0,
+            "max_wait_ms": round(self.max_wait_seconds * 1000, 3),
+            "mean_run_ms": round(self.total_run_seconds * 1000 / self.completed, 3) if self.completed else 0.0,
+        }
+
+password_hasher = PasswordHasher(
+    max_concurrency=int(os.environ.get('PASSWORD_HASH_CONCURRENCY', os.cpu_count() or 2)),
+    max_queue=int(os.environ.get('PASSWORD_HASH_MAX_QUEUE', 200)),
+)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -154,32 +1078,70 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+def credentials_exception():
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+def decode_token(token: str) -> dict:
     try:
-        token = credentials.credentials
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Could not validate credentials",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
     except InvalidTokenError:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Could not validate credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+        raise credentials_exception()
+    if payload.get("sub") is None:
+        raise credentials_exception()
+    return payload
+
+def decode_session_token(token: str) -> dict:
+    """Jeton de session (connexion) : les tickets à portée limitée (scope) sont refusés"""
+    payload = decode_token(token)
+    if "scope" in payload:
+        raise credentials_exception()
+    return payload
+
+def get_username_from_token(token: str) -> str:
+    return decode_session_token(token)["sub"]
+
+def get_current_user_fields(*fields: str):
+    """Dépendance qui ne charge que les champs demandés de l'utilisateur connecté.
+
+    Le document est lu avec une projection et validé en UserView, sans passer par
+    les champs inutiles à la route. Le résultat est mis en cache sous
+    (username, projection) ; toute écriture sur l'utilisateur invalide son username,
+    donc toutes ses projections.
+    """
+    projection = {"_id": 0, "username": 1, **{field: 1 for field in fields}}
+    if {"attack_inventory", "attack_history"} & set(fields):
+        # Comptes pas encore migrés vers l'inventaire compté
+        projection["attacks"] = 1
+    projection_key = tuple(sorted(fields))
     
-    user = await db.users.find_one({"username": username})
-    if user is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Could not validate credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    return User(**user)
+    async def dependency(credentials: HTTPAuthorizationCredentials = Depends(security)):
+        username = get_username_from_token(credentials.credentials)
+        
+        # Les objets en cache sont partagés entre requêtes : ne jamais les modifier
+        cached_user = user_cache.get(username, field=projection_key)
+        if cached_user is not None:
+            return cached_user
+        
+        version = user_cache.version(username)
+        user = await db.users.find_one({"username": username}, projection)
+        if user is None:
+            raise credentials_exception()
+        if "attacks" in user:
+            user = await migrate_attack_inventory(user, projection)
+        current_user = UserView(**user)
+        user_cache.put(username, current_user, version, field=projection_key)
+        return current_user
+    
+    return dependency
+
+
+async def get_current_username(credentials: HTTPAuthorizationCredentials = Depends(security)) -> str:
+    """Nom d'utilisateur du jeton, sans lecture en base : la route vérifie elle-même le compte"""
+    return get_username_from_token(credentials.credentials)
 
 
 # Define Models
@@ -216,17 +1178,38 @@ class Title(BaseModel):
     bonus_value: int
 
 class UserAttack(BaseModel):
+    """Carte de l'ancien inventaire (liste `attacks`), lue uniquement par la migration"""
     attack_id: int
     obtained_at: datetime = Field(default_factory=datetime.utcnow)
     used: bool = False
     used_at: Optional[datetime] = None
 
+class AttackHistoryEntry(BaseModel):
+    attack_id: int
+    event: str  # "obtained" ou "used"
+    at: datetime = Field(default_factory=datetime.utcnow)
+
+class ActiveEffect(BaseModel):
+    """Effet temporaire actif sur un joueur (vue matérialisée dans le document utilisateur)"""
+    attack_id: int
+    effect_type: str
+    effect_value: int
+    target_stat: Optional[str] = None
+    expires_at: datetime
+
 class AttackAction(BaseModel):
     target_username: str
     attack_id: int
     target_stat: Optional[str] = None
     effect_target: str  # "elo" ou "level"
 
+class AttackActionResult(BaseModel):
+    index: int
+    attack_id: int
+    target_username: str
+    status: int  # code HTTP qu'aurait renvoyé POST /user/attack
+    detail: str
+
 # User Models (updated)
 class UserCreate(BaseModel):
     username: str
@@ -242,8 +1225,9 @@ class User(BaseModel):
     username: str
     email: EmailStr
     created_at: datetime = Field(default_factory=datetime.utcnow)
-    is_online: bool = False
     last_login: Optional[datetime] = None
+    last_seen: Optional[datetime] = None
+    online_until: Optional[datetime] = None
     stats: dict = Field(default_factory=lambda: {
         "travail": {"level": 0, "xp": 0, "maxXp": 100, "elo": 1200},
         "sport": {"level": 0, "xp": 0, "maxXp": 100, "elo": 1200},
@@ -253,11 +1237,33 @@ class User(BaseModel):
     })
     friends: List[str] = Field(default_factory=list)
     club_id: Optional[str] = None
-    attacks: List[UserAttack] = Field(default_factory=list)
+    attack_inventory: Dict[str, int] = Field(default_factory=dict)  # attack_id -> cartes non utilisées
+    attack_history: List[AttackHistoryEntry] = Field(default_factory=list)
     defenses: List[int] = Field(default_factory=list)
     current_title: Optional[str] = "Novice"
     health: int = 100
     energy: int = 100
+    active_effects: List[ActiveEffect] = Field(default_factory=list)
+
+class UserView(BaseModel):
+    """Utilisateur partiel (document chargé avec une projection) : les champs non chargés valent None"""
+    username: str
+    id: Optional[str] = None
+    email: Optional[EmailStr] = None
+    created_at: Optional[datetime] = None
+    last_login: Optional[datetime] = None
+    last_seen: Optional[datetime] = None
+    online_until: Optional[datetime] = None
+    stats: Optional[dict] = None
+    friends: Optional[List[str]] = None
+    club_id: Optional[str] = None
+    attack_inventory: Optional[Dict[str, int]] = None
+    attack_history: Optional[List[AttackHistoryEntry]] = None
+    defenses: Optional[List[int]] = None
+    current_title: Optional[str] = None
+    health: Optional[int] = None
+    energy: Optional[int] = None
+    active_effects: Optional[List[ActiveEffect]] = None
 
 class Token(BaseModel):
     access_token: str
@@ -269,223 +1275,1671 @@ class UserProfile(BaseModel):
     stats: dict
     is_online: bool
     last_login: Optional[datetime] = None
+    last_seen: Optional[datetime] = None
+
+USER_PROFILE_PROJECTION = {
+    "_id": 0, "id": 1, "username": 1, "stats": 1, "last_login": 1, "last_seen": 1, "online_until": 1
+}
+FRIENDS_PAGE_MAX = 500
+
+def user_profile_from_doc(user: dict) -> UserProfile:
+    username = user["username"]
+    return UserProfile(
+        id=user["id"],
+        username=username,
+        stats=user["stats"],
+        is_online=presence_tracker.is_online(username, user.get("online_until")),
+        last_login=user.get("last_login"),
+        last_seen=presence_tracker.last_seen(username, user.get("last_seen"))
+    )
+
+async def load_user_profiles(usernames: List[str]) -> List[UserProfile]:
+    """Charge les profils en une seule requête $in, dans l'ordre de la liste fournie"""
+    if not usernames:
+        return []
+    users = await db.users.find(
+        {"username": {"$in": usernames}}, USER_PROFILE_PROJECTION
+    ).to_list(len(usernames))
+    users_by_name = {user["username"]: user for user in users}
+    return [
+        user_profile_from_doc(users_by_name[username])
+        for username in usernames
+        if username in users_by_name
+    ]
+
+# Présence en ligne
+# Les clients envoient un battement (POST /user/heartbeat) toutes les
+# PRESENCE_HEARTBEAT_SECONDS ; chaque worker garde en mémoire la date du dernier
+# battement reçu. Un joueur est en ligne tant que son dernier battement a moins de
+# PRESENCE_TIMEOUT_SECONDS : onglet fermé ou jeton expiré, il repasse hors ligne
+# sans aucune écriture. Les changements sont écrits en base par lots (bulk_write)
+# toutes les PRESENCE_FLUSH_SECONDS, dans last_seen / online_until, pour que les
+# autres workers connaissent les joueurs qu'ils ne voient pas passer.
+PRESENCE_HEARTBEAT_SECONDS = int(os.environ.get('PRESENCE_HEARTBEAT_SECONDS', 30))
+PRESENCE_TIMEOUT_SECONDS = int(os.environ.get('PRESENCE_TIMEOUT_SECONDS', 90))
+PRESENCE_FLUSH_SECONDS = int(os.environ.get('PRESENCE_FLUSH_SECONDS', 30))
+
+class PresenceTracker:
+    """Dernier battement par joueur (en mémoire) et écritures en attente de flush"""
+    
+    def __init__(self, timeout_seconds: int):
+        self.timeout = timedelta(seconds=timeout_seconds)
+        self.seen: Dict[str, datetime] = {}
+        self.pending: Dict[str, dict] = {}
+        self.flushed = 0
+    
+    def beat(self, username: str, now: Optional[datetime] = None) -> datetime:
+        now = now or datetime.utcnow()
+        self.seen[username] = now
+        online_until = now + self.timeout
+        self.pending[username] = {"last_seen": now, "online_until": online_until}
+        return online_until
+    
+    def leave(self, username: str, now: Optional[datetime] = None):
+        now = now or datetime.utcnow()
+        last_seen = self.seen.pop(username, None)
+        self.pending[username] = {"online_until": now}
+        if last_seen is not None:
+            self.pending[username]["last_seen"] = last_seen
+    
+    def is_online(self, username: str, online_until: Optional[datetime] = None, now: Optional[datetime] = None) -> bool:
+        """En ligne d'après ce worker, sinon d'après le dernier flush (autres workers)"""
+        now = now or datetime.utcnow()
+        pending = self.pending.get(username)
+        if pending is not None:
+            # Battement ou déconnexion pas encore écrits : état le plus récent
+            return pending["online_until"] > now
+        last_seen = self.seen.get(username)
+        if last_seen is not None and now - last_seen < self.timeout:
+            return True
+        return online_until is not None and online_until > now
+    
+    def last_seen(self, username: str, stored: Optional[datetime] = None) -> Optional[datetime]:
+        last_seen = self.seen.get(username)
+        if last_seen is None or (stored is not None and stored > last_seen):
+            return stored
+        return last_seen
+    
+    def expire(self, now: Optional[datetime] = None) -> int:
+        """Oublie les joueurs sans battement récent (leur online_until est déjà écrit)"""
+        now = now or datetime.utcnow()
+        stale = [username for username, last_seen in self.seen.items() if now - last_seen >= self.timeout]
+        for username in stale:
+            del self.seen[username]
+        return len(stale)
+    
+    def drain(self) -> List[UpdateOne]:
+        pending, self.pending = self.pending, {}
+        return [UpdateOne({"username": username}, {"$set": fields}) for username, fields in pending.items()]
+    
+    def stats(self) -> dict:
+        return {"online": len(self.seen), "pending_writes": len(self.pending), "flushed": self.flushed}
+
+presence_tracker = PresenceTracker(PRESENCE_TIMEOUT_SECONDS)
+
+async def flush_presence():
+    updates = presence_tracker.drain()
+    if updates:
+        await db.users.bulk_write(updates, ordered=False)
+        presence_tracker.flushed += len(updates)
+
+async def run_presence_flush():
+    while True:
+        await asyncio.sleep(PRESENCE_FLUSH_SECONDS)
+        presence_tracker.expire()
+        try:
+            await flush_presence()
+        except PyMongoError:
+            logger.exception("Écriture de la présence impossible")
+
+# User search (préfixe indexé sur username_lower + trigrammes pour la recherche approchée)
+USER_SEARCH_PAGE_MAX = 50
+USER_SEARCH_BACKFILL_BATCH = 1000
+PREFIX_UPPER_BOUND = "\U0010ffff"
+
+class UserSearchResults(BaseModel):
+    results: List[UserProfile]
+    next_cursor: Optional[str] = None
+
+def normalize_username(username: str) -> str:
+    return username.strip().lower()
+
+def username_trigrams(username: str) -> List[str]:
+    """Trigrammes du nom normalisé, avec bourrage pour favoriser les débuts de nom"""
+    padded = f"  {normalize_username(username)} "
+    return sorted({padded[i:i + 3] for i in range(len(padded) - 2)})
+
+def user_search_fields(username: str) -> dict:
+    return {
+        "username_lower": normalize_username(username),
+        "username_trigrams": username_trigrams(username),
+    }
+
+async def search_users(query: str, limit: int, after: Optional[str] = None, fuzzy: bool = True):
+    """Recherche classée : correspondances par préfixe (ordre alphabétique, paginées),
+    complétées en première page par des correspondances approchées (trigrammes).
+
+    La saisie n'est jamais interprétée comme une expression régulière : le préfixe
+    est résolu par un intervalle [q, q + U+10FFFF) sur l'index username_lower.
+    """
+    normalized = normalize_username(query)
+    if not normalized:
+        return [], None
+    
+    prefix_filter = {"username_lower": {"$gte": normalized, "$lt": normalized + PREFIX_UPPER_BOUND}}
+    if after is not None:
+        # Le curseur est le dernier username renvoyé ; (username_lower, username) est unique
+        after_lower = normalize_username(after)
+        prefix_filter["$or"] = [
+            {"username_lower": {"$gt": after_lower}},
+            {"username_lower": after_lower, "username": {"$gt": after}},
+        ]
+    
+    prefix_users = await db.users.find(
+        prefix_filter, USER_PROFILE_PROJECTION
+    ).sort([("username_lower", ASCENDING), ("username", ASCENDING)]).limit(limit + 1).to_list(limit + 1)
+    
+    next_cursor = None
+    if len(prefix_users) > limit:
+        prefix_users = prefix_users[:limit]
+        next_cursor = prefix_users[-1]["username"]
+    
+    results = [user_profile_from_doc(user) for user in prefix_users]
+    
+    remaining = limit - len(results)
+    if fuzzy and after is None and remaining > 0:
+        query_grams = username_trigrams(normalized)
+        min_score = max(1, len(query_grams) // 2)
+        seen = {user["username"] for user in prefix_users}
+        fuzzy_users = await db.users.aggregate([
+            {"$match": {"username_trigrams": {"$in": query_grams}}},
+            {"$project": {
+                **USER_PROFILE_PROJECTION,
+                "username_lower": 1,
+                "score": {"$size": {"$setIntersection": ["$username_trigrams", {"$literal": query_grams}]}},
+            }},
+            {"$match": {"score": {"$gte": min_score}}},
+            {"$sort": {"score": -1, "username_lower": 1}},
+            {"$limit": remaining + len(seen)},
+        ]).to_list(remaining + len(seen))
+        results.extend(
+            user_profile_from_doc(user)
+            for user in fuzzy_users
+            if user["username"] not in seen
+        )
+        results = results[:limit]
+    
+    return results, next_cursor
+
+async def backfill_user_search_fields():
+    """Ajoute username_lower / username_trigrams aux comptes créés avant la recherche indexée"""
+    try:
+        cursor = db.users.find({"username_lower": {"$exists": False}}, {"_id": 1, "username": 1})
+        batch = []
+        async for user in cursor:
+            batch.append(UpdateOne({"_id": user["_id"]}, {"$set": user_search_fields(user["username"])}))
+            if len(batch) >= USER_SEARCH_BACKFILL_BATCH:
+                await db.users.bulk_write(batch, ordered=False)
+                batch = []
+        if batch:
+            await db.users.bulk_write(batch, ordered=False)
+    except PyMongoError:
+        logger.exception("Migration des champs de recherche utilisateur interrompue")
+
+# Classements ELO
+# Chaque worker garde en mémoire, pour chaque stat, une SortedList de (-ELO, username) :
+# rang, ajout et retrait en O(log n), top-N en O(log n + N). Une écriture isolée (attaque
+# appliquée, inscription) met le classement à jour immédiatement ; les écritures en bloc
+# (résolution de minuit, roue temporelle) sont marquées en attente et reconstruites hors
+# de la boucle d'événements par une tâche de fond. Une reconstruction périodique depuis
+# MongoDB reprend les écritures des autres workers ; tant que le classement n'est pas
+# chargé, les routes utilisent les index elo_<stat> (pagination par clé autour d'un rang).
+LEADERBOARD_REFRESH_SECONDS = int(os.environ.get('LEADERBOARD_REFRESH_SECONDS', 600))
+LEADERBOARD_PAGE_MAX = 100
+LEADERBOARD_FALLBACK_OFFSET_MAX = 1000
+LEADERBOARD_ELO_PROJECTION = {
+    "_id": 0, "username": 1, "club_id": 1, **{f"stats.{stat_name}.elo": 1 for stat_name in STAT_NAMES}
+}
+
+def user_elos(user: dict) -> tuple:
+    stats = user.get("stats") or {}
+    return tuple(stats.get(stat_name, {}).get("elo", 0) for stat_name in STAT_NAMES)
+
+class EloLeaderboard:
+    """Classements en mémoire de toutes les stats (SortedList de (-ELO, username) par stat)"""
+
+    def __init__(self, stat_names):
+        self.stat_indexes = {stat_name: index for index, stat_name in enumerate(stat_names)}
+        self.elos = {}  # username -> ELO par stat (ordre de stat_names)
+        self.ranked = {stat_name: SortedList() for stat_name in stat_names}
+        self.ready = False
+        self.dirty = None  # écritures reçues pendant une reconstruction
+        self.pending = {}  # écritures en bloc en attente de la prochaine reconstruction
+        self.pending_event = asyncio.Event()
+        self.rebuild_lock = asyncio.Lock()
+
+    def __len__(self):
+        return len(self.elos)
+
+    def build(self, elos: dict) -> dict:
+        """Classements pour un instantané {username: elos} (appelé hors de la boucle d'événements)"""
+        return {
+            stat_name: SortedList((-user_elo[index], username) for username, user_elo in elos.items())
+            for stat_name, index in self.stat_indexes.items()
+        }
+
+    def begin_refresh(self):
+        self.dirty = {}
+
+    def finish_refresh(self, elos: dict, ranked: dict):
+        """Installe un instantané, en rejouant les écritures arrivées pendant sa construction"""
+        dirty, self.dirty = self.dirty or {}, None
+        self.elos = elos
+        self.ranked = ranked
+        self.ready = True
+        for username, user_elo in dirty.items():
+            self.update(username, user_elo)
+
+    def update(self, username: str, user_elo: tuple):
+        """Repositionne le joueur dans chaque classement : O(log n) par stat"""
+        if self.dirty is not None:
+            self.dirty[username] = user_elo
+        if not self.ready:
+            return
+        previous = self.elos.get(username)
+        if previous == user_elo:
+            return
+        for stat_name, index in self.stat_indexes.items():
+            ranked = self.ranked[stat_name]
+            if previous is not None:
+                ranked.remove((-previous[index], username))
+            ranked.add((-user_elo[index], username))
+        self.elos[username] = user_elo
+
+    def defer(self, username: str, user_elo: tuple):
+        """Écriture en bloc : appliquée à la prochaine reconstruction (voir run_leaderboard_rebuilds)"""
+        if self.dirty is not None:
+            # Reconstruction en cours : rejouée par finish_refresh
+            self.dirty[username] = user_elo
+        elif self.ready:
+            self.pending[username] = user_elo
+            self.pending_event.set()
+
+    def top(self, stat_name: str, offset: int, limit: int) -> List[dict]:
+        return [
+            {"rank": offset + position + 1, "username": username, "elo": -negative_elo}
+            for position, (negative_elo, username) in enumerate(
+                self.ranked[stat_name].islice(offset, offset + limit)
+            )
+        ]
+
+    def rank(self, stat_name: str, username: str) -> Optional[int]:
+        """Rang (à partir de 1) du joueur, None s'il est inconnu"""
+        user_elo = self.elos.get(username)
+        if user_elo is None:
+            return None
+        index = self.stat_indexes[stat_name]
+        return self.ranked[stat_name].bisect_left((-user_elo[index], username)) + 1
+
+elo_leaderboard = EloLeaderboard(STAT_NAMES)
+
+async def rebuild_elo_leaderboard(load_elos):
+    """Reconstruit les classements (tri dans un thread) depuis l'instantané retourné par load_elos"""
+    async with elo_leaderboard.rebuild_lock:
+        elo_leaderboard.begin_refresh()
+        try:
+            elos = await load_elos()
+            ranked = await asyncio.to_thread(elo_leaderboard.build, elos)
+        except BaseException:
+            elo_leaderboard.dirty = None
+            raise
+        elo_leaderboard.finish_refresh(elos, ranked)
+
+async def load_elos_from_db() -> dict:
+    elos = {}
+    async for user in db.users.find({}, LEADERBOARD_ELO_PROJECTION):
+        elos[user["username"]] = user_elos(user)
+    return elos
+
+async def load_pending_elos() -> dict:
+    pending, elo_leaderboard.pending = elo_leaderboard.pending, {}
+    return {**elo_leaderboard.elos, **pending}
+
+async def refresh_elo_leaderboard():
+    """Reconstruit le classement en mémoire depuis MongoDB"""
+    await rebuild_elo_leaderboard(load_elos_from_db)
+
+async def run_leaderboard_refresh():
+    while True:
+        try:
+            await refresh_elo_leaderboard()
+        except PyMongoError:
+            logger.exception("Reconstruction du classement ELO impossible")
+        await asyncio.sleep(LEADERBOARD_REFRESH_SECONDS)
+
+async def run_leaderboard_rebuilds():
+    """Applique les écritures en bloc en attente (une reconstruction à la fois, regroupées)"""
+    while True:
+        await elo_leaderboard.pending_event.wait()
+        elo_leaderboard.pending_event.clear()
+        if elo_leaderboard.pending:
+            await rebuild_elo_leaderboard(load_pending_elos)
+
+def record_elos(users: List[dict], bulk: bool = False):
+    """Répercute dans le classement (et les statistiques de club) les ELO relus après une écriture"""
+    record = elo_leaderboard.defer if bulk else elo_leaderboard.update
+    for user in users:
+        record(user["username"], user_elos(user))
+        mark_club_stats_dirty(user.get("club_id"))
+
+async def reload_elos(usernames: List[str]):
+    """Relit (une requête $in) et répercute en bloc les ELO de joueurs modifiés côté serveur"""
+    if usernames:
+        record_elos(await db.users.find(
+            {"username": {"$in": usernames}}, LEADERBOARD_ELO_PROJECTION
+        ).to_list(None), bulk=True)
+
+def leaderboard_stat(stat: str) -> str:
+    if stat not in STAT_NAMES:
+        raise HTTPException(status_code=400, detail="Stat non valide")
+    return stat
+
+def leaderboard_entries(stat: str, users: List[dict], first_rank: int) -> List[dict]:
+    index = STAT_NAMES.index(stat)
+    return [
+        {"rank": first_rank + position, "username": user["username"], "elo": user_elos(user)[index]}
+        for position, user in enumerate(users)
+    ]
+
+async def leaderboard_page(stat: str, offset: int, limit: int) -> List[dict]:
+    if elo_leaderboard.ready:
+        return elo_leaderboard.top(stat, offset, limit)
+    if offset > LEADERBOARD_FALLBACK_OFFSET_MAX:
+        # Sans classement en mémoire, un skip profond parcourrait tout l'index elo_<stat>
+        raise HTTPException(
+            status_code=503,
+            detail="Classement en cours de chargement, réessayez dans un instant",
+            headers={"Retry-After": "5"}
+        )
+    elo_path = f"stats.{stat}.elo"
+    users = await db.users.find({}, LEADERBOARD_ELO_PROJECTION).sort(
+        [(elo_path, DESCENDING), ("username", ASCENDING)]
+    ).skip(offset).limit(limit).to_list(limit)
+    return leaderboard_entries(stat, users, offset + 1)
+
+async def leaderboard_around(stat: str, entry: dict, radius: int) -> List[dict]:
+    """Joueurs classés autour d'une entrée (rang, username, elo)"""
+    offset = max(0, entry["rank"] - 1 - radius)
+    if elo_leaderboard.ready:
+        return elo_leaderboard.top(stat, offset, entry["rank"] - offset + radius)
+    
+    # Pagination par clé sur l'index elo_<stat>, de part et d'autre du joueur
+    elo_path = f"stats.{stat}.elo"
+    elo, username = entry["elo"], entry["username"]
+    ahead = await db.users.find(
+        {"$or": [{elo_path: {"$gt": elo}}, {elo_path: elo, "username": {"$lt": username}}]},
+        LEADERBOARD_ELO_PROJECTION
+    ).sort([(elo_path, ASCENDING), ("username", DESCENDING)]).limit(radius).to_list(radius)
+    behind = await db.users.find(
+        {"$or": [{elo_path: {"$lt": elo}}, {elo_path: elo, "username": {"$gt": username}}]},
+        LEADERBOARD_ELO_PROJECTION
+    ).sort([(elo_path, DESCENDING), ("username", ASCENDING)]).limit(radius).to_list(radius)
+    ahead.reverse()
+    return [
+        *leaderboard_entries(stat, ahead, entry["rank"] - len(ahead)),
+        {"rank": entry["rank"], "username": username, "elo": elo},
+        *leaderboard_entries(stat, behind, entry["rank"] + 1),
+    ]
+
+async def leaderboard_rank(stat: str, username: str) -> Optional[dict]:
+    index = STAT_NAMES.index(stat)
+    if elo_leaderboard.ready:
+        rank = elo_leaderboard.rank(stat, username)
+        if rank is None:
+            return None
+        return {"rank": rank, "username": username, "elo": elo_leaderboard.elos[username][index]}
+    
+    user = await db.users.find_one({"username": username}, LEADERBOARD_ELO_PROJECTION)
+    if user is None:
+        return None
+    elo = user_elos(user)[index]
+    elo_path = f"stats.{stat}.elo"
+    ahead = await db.users.count_documents(
+        {"$or": [{elo_path: {"$gt": elo}}, {elo_path: elo, "username": {"$lt": username}}]}
+    )
+    return {"rank": ahead + 1, "username": username, "elo": elo}
+
+@api_router.get("/leaderboard/{stat}")
+async def get_leaderboard(
+    stat: str,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=LEADERBOARD_PAGE_MAX),
+    username: str = Depends(get_current_username)
+):
+    """Classement ELO d'une stat (paginé avec offset/limit)"""
+    stat = leaderboard_stat(stat)
+    return {
+        "stat": stat,
+        "total": len(elo_leaderboard) if elo_leaderboard.ready else None,
+        "entries": await leaderboard_page(stat, offset, limit)
+    }
+
+@api_router.get("/leaderboard/{stat}/rank/{target_username}")
+async def get_leaderboard_rank(
+    stat: str,
+    target_username: str,
+    radius: int = Query(5, ge=0, le=LEADERBOARD_PAGE_MAX // 2),
+    username: str = Depends(get_current_username)
+):
+    """Rang d'un joueur dans le classement d'une stat, avec les joueurs autour de lui"""
+    stat = leaderboard_stat(stat)
+    entry = await leaderboard_rank(stat, target_username)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Utilisateur non trouvé")
+    
+    return {
+        "stat": stat,
+        **entry,
+        "around": await leaderboard_around(stat, entry, radius)
+    }
 
 # Attack/Card endpoints
 @api_router.get("/attacks")
-async def get_all_attacks():
+async def get_all_attacks(request: Request):
     """Récupère toutes les attaques disponibles"""
-    return ATTACKS_DATA
+    return ATTACKS_PAYLOAD.response(request)
 
 @api_router.get("/defenses")
-async def get_all_defenses():
+async def get_all_defenses(request: Request):
     """Récupère toutes les défenses disponibles"""
-    return DEFENSES_DATA
+    return DEFENSES_PAYLOAD.response(request)
 
 @api_router.get("/titles")
-async def get_all_progression_titles():
+async def get_all_progression_titles(request: Request):
     """Récupère tous les titres de progression disponibles"""
-    return TITLES_DATA
+    return TITLES_PAYLOAD.response(request)
 
 @api_router.get("/special-titles")  
-async def get_all_special_titles():
+async def get_all_special_titles(request: Request):
     """Récupère tous les titres spéciaux disponibles"""
-    return SPECIAL_TITLES_DATA
+    return SPECIAL_TITLES_PAYLOAD.response(request)
 
-@api_router.get("/user/attacks")
-async def get_user_attacks(current_user: User = Depends(get_current_user)):
-    """Récupère les attaques d'un utilisateur"""
-    available_attacks = []
-    for user_attack in current_user.attacks:
+# Inventaire d'attaques
+# Les cartes sont comptées par attack_id (attack_inventory, mis à jour avec $inc) ;
+# attack_history garde les ATTACK_HISTORY_SIZE derniers gains/utilisations.
+# L'ancienne liste `attacks` est convertie à la première lecture du compte et par
+# une migration de fond au démarrage.
+ATTACK_HISTORY_SIZE = int(os.environ.get('ATTACK_HISTORY_SIZE', 20))
+ATTACK_INVENTORY_MIGRATION_BATCH = 500
+
+def add_attack_history(update: dict, *entries: AttackHistoryEntry) -> dict:
+    """Ajoute à une mise à jour le $push des entrées dans l'historique borné"""
+    if ATTACK_HISTORY_SIZE > 0:
+        update.setdefault("$push", {})["attack_history"] = {
+            "$each": [entry.dict() for entry in entries],
+            "$slice": -ATTACK_HISTORY_SIZE
+        }
+    return update
+
+def attack_inventory_migration(attacks: List[dict]) -> dict:
+    """Mise à jour convertissant une liste `attacks` en inventaire compté"""
+    counts = {}
+    history = []
+    for attack in attacks:
+        user_attack = UserAttack(**attack)
         if not user_attack.used:
-            attack_data = next((a for a in ATTACKS_DATA if a["id"] == user_attack.attack_id), None)
-            if attack_data:
-                available_attacks.append({
-                    **attack_data,
-                    "obtained_at": user_attack.obtained_at
-                })
-    return available_attacks
+            key = str(user_attack.attack_id)
+            counts[key] = counts.get(key, 0) + 1
+        history.append(AttackHistoryEntry(attack_id=user_attack.attack_id, event="obtained", at=user_attack.obtained_at))
+        if user_attack.used:
+            history.append(AttackHistoryEntry(
+                attack_id=user_attack.attack_id, event="used", at=user_attack.used_at or user_attack.obtained_at
+            ))
+    history.sort(key=lambda entry: entry.at)
+    
+    update = {"$unset": {"attacks": ""}}
+    if counts:
+        update["$inc"] = {f"attack_inventory.{key}": count for key, count in counts.items()}
+    if history:
+        add_attack_history(update, *history[-ATTACK_HISTORY_SIZE:])
+    return update
 
-@api_router.post("/user/attack")
-async def use_attack(attack_action: AttackAction, current_user: User = Depends(get_current_user)):
-    """Utilise une attaque contre un autre joueur"""
-    # Vérifier que l'utilisateur possède cette attaque
-    user_attack = next((ua for ua in current_user.attacks if ua.attack_id == attack_action.attack_id and not ua.used), None)
-    if not user_attack:
-        raise HTTPException(status_code=400, detail="Attaque non disponible")
-    
-    # Vérifier que la cible existe
-    target_user = await db.users.find_one({"username": attack_action.target_username})
-    if not target_user:
-        raise HTTPException(status_code=404, detail="Utilisateur cible non trouvé")
-    
-    # Marquer l'attaque comme utilisée
+async def migrate_attack_inventory(user: dict, projection: Optional[dict] = None) -> dict:
+    """Migre un compte lu avec sa liste `attacks` et renvoie le document à jour.
+
+    La mise à jour est conditionnée à la liste lue : si elle a changé entre-temps,
+    la migration sera refaite à la prochaine lecture.
+    """
     await db.users.update_one(
-        {"username": current_user.username, "attacks.attack_id": attack_action.attack_id},
-        {"$set": {"attacks.$.used": True, "attacks.$.used_at": datetime.utcnow()}}
+        {"username": user["username"], "attacks": user["attacks"]},
+        attack_inventory_migration(user["attacks"])
     )
+    return await db.users.find_one({"username": user["username"]}, projection) or user
+
+async def backfill_attack_inventory():
+    """Migre en fond les comptes qui ont encore une liste `attacks`"""
+    try:
+        cursor = db.users.find({"attacks": {"$exists": True}}, {"_id": 1, "attacks": 1})
+        batch = []
+        async for user in cursor:
+            batch.append(UpdateOne(
+                {"_id": user["_id"], "attacks": user["attacks"]},
+                attack_inventory_migration(user["attacks"])
+            ))
+            if len(batch) >= ATTACK_INVENTORY_MIGRATION_BATCH:
+                await db.users.bulk_write(batch, ordered=False)
+                batch = []
+        if batch:
+            await db.users.bulk_write(batch, ordered=False)
+    except PyMongoError:
+        logger.exception("Migration de l'inventaire d'attaques interrompue")
+
+@api_router.get("/user/attacks")
+async def get_user_attacks(current_user: UserView = Depends(get_current_user_fields("attack_inventory", "attack_history"))):
+    """Récupère les attaques d'un utilisateur (une entrée par carte non utilisée)"""
+    last_obtained = {
+        entry.attack_id: entry.at
+        for entry in current_user.attack_history or []
+        if entry.event == "obtained"
+    }
+    
+    available_attacks = []
+    for attack_id, count in (current_user.attack_inventory or {}).items():
+        attack_data = get_attack(int(attack_id))
+        if attack_data and count > 0:
+            card = {**attack_data, "obtained_at": last_obtained.get(attack_data["id"])}
+            available_attacks.extend(card for _ in range(count))
+    return available_attacks
+
+USE_ATTACK_REFUSAL_PROJECTION = {"_id": 0, "username": 1, "attack_inventory": 1, "active_effects": 1, "attacks": 1}
+
+async def attack_refusal(username: str, attack_action: AttackAction) -> HTTPException:
+    """Erreur à renvoyer quand la consommation conditionnelle d'une carte a échoué"""
+    user = await db.users.find_one({"username": username}, USE_ATTACK_REFUSAL_PROJECTION)
+    if user is None:
+        return credentials_exception()
+    user_view = UserView(**user)
+    if attack_blocked(user_view.active_effects, attack_action.target_stat):
+        return HTTPException(status_code=403, detail="Un effet actif vous empêche d'attaquer")
+    return HTTPException(status_code=400, detail="Attaque non disponible")
+
+@api_router.post("/user/attack")
+async def use_attack(attack_action: AttackAction, username: str = Depends(get_current_username)):
+    """Utilise une attaque contre un autre joueur.
+
+    La carte est consommée par une mise à jour conditionnelle (il en reste une et
+    aucun effet actif ne bloque l'attaque), envoyée en même temps que la vérification
+    de la cible ; l'action est ensuite insérée : deux allers-retours au total.
+    """
+    now = datetime.utcnow()
+    now = now.replace(microsecond=now.microsecond // 1000 * 1000)  # précision des dates BSON
+    inventory_key = f"attack_inventory.{attack_action.attack_id}"
+    used_entry = AttackHistoryEntry(attack_id=attack_action.attack_id, event="used", at=now)
+    consume_filter = {
+        "username": username,
+        inventory_key: {"$gte": 1},
+        "active_effects": attack_block_filter(now, attack_action.target_stat)
+    }
+    
+    async def consume_card(session=None) -> bool:
+        result = await db.users.update_one(
+            consume_filter,
+            add_attack_history({"$inc": {inventory_key: -1}}, used_entry),
+            session=session
+        )
+        return result.modified_count == 1
     
     # Créer l'action d'attaque (sera appliquée à minuit ou à la connexion)
     attack_effect = {
-        "attacker": current_user.username,
+        "attacker": username,
         "target": attack_action.target_username,
         "attack_id": attack_action.attack_id,
         "target_stat": attack_action.target_stat,
         "effect_target": attack_action.effect_target,
-        "created_at": datetime.utcnow(),
+        "created_at": now,
         "applied": False
     }
     
-    await db.attack_actions.insert_one(attack_effect)
+    async with mongo_transaction() as session:
+        target_lookup = db.users.find_one({"username": attack_action.target_username}, {"_id": 1}, session=session)
+        if session is None:
+            target_user, consumed = await asyncio.gather(target_lookup, consume_card())
+        else:
+            # Une session n'accepte pas d'opérations concurrentes
+            target_user = await target_lookup
+            consumed = target_user is not None and await consume_card(session)
+        
+        if not consumed and (target_user is not None or session is None):
+            user = await db.users.find_one({"username": username}, USE_ATTACK_REFUSAL_PROJECTION)
+            if user is not None and "attacks" in user:
+                # Compte pas encore migré vers l'inventaire compté
+                await migrate_attack_inventory(user)
+                consumed = await consume_card(session)
+            if not consumed:
+                raise await attack_refusal(username, attack_action)
+        user_cache.invalidate(username)
+        
+        if not target_user:
+            if consumed and session is None:
+                # Rendre la carte consommée en parallèle de la vérification
+                await db.users.update_one(
+                    {"username": username},
+                    {"$inc": {inventory_key: 1}, "$pull": {"attack_history": used_entry.dict()}}
+                )
+            raise HTTPException(status_code=404, detail="Utilisateur cible non trouvé")
+        
+        await db.attack_actions.insert_one(attack_effect, session=session)
     
+    publish_attack_actions([attack_effect])
     return {"message": f"Attaque envoyée vers {attack_action.target_username}", "attack_id": attack_action.attack_id}
 
+# Envoi groupé d'attaques
+ATTACK_BATCH_MAX = 50
+ATTACK_BATCH_ATTEMPTS = 3
+
+def allocate_attack_batch(attack_actions: List[AttackAction], user: UserView, existing_targets: set, now: datetime):
+    """Répartit les cartes disponibles entre les attaques du lot (dans l'ordre).
+
+    Retourne les résultats par attaque et le nombre de cartes consommées par attack_id.
+    """
+    inventory = dict(user.attack_inventory or {})
+    spent = {}
+    results = []
+    for index, attack_action in enumerate(attack_actions):
+        key = str(attack_action.attack_id)
+        if inventory.get(key, 0) - spent.get(key, 0) < 1:
+            status_code, detail = 400, "Attaque non disponible"
+        elif attack_blocked(user.active_effects, attack_action.target_stat):
+            status_code, detail = 403, "Un effet actif vous empêche d'attaquer"
+        elif attack_action.target_username not in existing_targets:
+            status_code, detail = 404, "Utilisateur cible non trouvé"
+        else:
+            spent[key] = spent.get(key, 0) + 1
+            status_code, detail = 200, f"Attaque envoyée vers {attack_action.target_username}"
+        results.append(AttackActionResult(
+            index=index,
+            attack_id=attack_action.attack_id,
+            target_username=attack_action.target_username,
+            status=status_code,
+            detail=detail
+        ))
+    return results, spent
+
+@api_router.post("/user/attacks/batch")
+async def use_attacks_batch(
+    attack_actions: List[AttackAction],
+    current_user: UserView = Depends(get_current_user_fields("attack_inventory", "active_effects"))
+):
+    """Envoie plusieurs attaques en une requête, avec un résultat par attaque.
+
+    Les cibles sont vérifiées en une requête $in, toutes les cartes sont consommées
+    par une seule mise à jour conditionnelle et les actions insérées avec insert_many.
+    Si l'inventaire a changé entre-temps, il est relu et la répartition recalculée.
+    """
+    if not attack_actions:
+        return {"results": [], "sent": 0}
+    if len(attack_actions) > ATTACK_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"Au plus {ATTACK_BATCH_MAX} attaques par envoi")
+    
+    now = datetime.utcnow()
+    target_usernames = list({attack_action.target_username for attack_action in attack_actions})
+    existing_targets = set(await db.users.distinct("username", {"username": {"$in": target_usernames}}))
+    
+    user = current_user
+    for _ in range(ATTACK_BATCH_ATTEMPTS):
+        results, spent = allocate_attack_batch(attack_actions, user, existing_targets, now)
+        accepted = [attack_actions[result.index] for result in results if result.status == 200]
+        if not accepted:
+            return {"results": results, "sent": 0}
+        
+        consume_filter = {
+            "username": current_user.username,
+            "active_effects": attack_block_filter(now, *{attack_action.target_stat for attack_action in accepted}),
+            **{f"attack_inventory.{key}": {"$gte": count} for key, count in spent.items()}
+        }
+        consume_update = add_attack_history(
+            {"$inc": {f"attack_inventory.{key}": -count for key, count in spent.items()}},
+            *[AttackHistoryEntry(attack_id=attack_action.attack_id, event="used", at=now) for attack_action in accepted]
+        )
+        async with mongo_transaction() as session:
+            consumed = await db.users.update_one(consume_filter, consume_update, session=session)
+            if consumed.modified_count == 1:
+                sent_attacks = [
+                    {
+                        "attacker": current_user.username,
+                        "target": attack_action.target_username,
+                        "attack_id": attack_action.attack_id,
+                        "target_stat": attack_action.target_stat,
+                        "effect_target": attack_action.effect_target,
+                        "created_at": now,
+                        "applied": False
+                    }
+                    for attack_action in accepted
+                ]
+                await db.attack_actions.insert_many(sent_attacks, session=session)
+        user_cache.invalidate(current_user.username)
+        if consumed.modified_count == 1:
+            publish_attack_actions(sent_attacks)
+            return {"results": results, "sent": len(accepted)}
+        
+        # Inventaire ou effets modifiés par une autre requête : relire et recommencer
+        user_doc = await db.users.find_one({"username": current_user.username}, USE_ATTACK_REFUSAL_PROJECTION)
+        if user_doc is None:
+            raise credentials_exception()
+        if "attacks" in user_doc:
+            user_doc = await migrate_attack_inventory(user_doc, USE_ATTACK_REFUSAL_PROJECTION)
+        user = UserView(**user_doc)
+    
+    raise HTTPException(status_code=409, detail="Inventaire modifié pendant l'envoi, veuillez réessayer")
+
 @api_router.post("/user/level-up")
-async def level_up_user(stat_name: str, current_user: User = Depends(get_current_user)):
+async def level_up_user(stat_name: str, username: str = Depends(get_current_username)):
     """Fait monter un utilisateur de niveau et lui donne une attaque aléatoire"""
-    if stat_name not in current_user.stats:
+    if stat_name not in STAT_NAMES:
         raise HTTPException(status_code=400, detail="Stat non valide")
     
-    # Incrémenter le niveau
-    current_stat = current_user.stats[stat_name]
-    new_level = current_stat["level"] + 1
-    
     # Donner une attaque aléatoire
-    random_attack_id = random.randint(1, 50)
-    new_attack = UserAttack(attack_id=random_attack_id)
+    random_attack_id = random.choice(ATTACK_IDS)
     
-    # Mettre à jour en base
-    await db.users.update_one(
-        {"username": current_user.username},
-        {
-            "$set": {f"stats.{stat_name}.level": new_level},
-            "$push": {"attacks": new_attack.dict()}
-        }
+    # Incrément atomique en base : deux montées de niveau simultanées comptent toutes les deux
+    level_path = f"stats.{stat_name}.level"
+    user = await db.users.find_one_and_update(
+        {"username": username},
+        add_attack_history(
+            {"$inc": {level_path: 1, f"attack_inventory.{random_attack_id}": 1}},
+            AttackHistoryEntry(attack_id=random_attack_id, event="obtained")
+        ),
+        projection={"_id": 0, level_path: 1, "club_id": 1},
+        return_document=ReturnDocument.AFTER
     )
+    if user is None:
+        raise credentials_exception()
+    user_cache.invalidate(username)
+    mark_club_stats_dirty(user.get("club_id"))
     
-    attack_info = next((a for a in ATTACKS_DATA if a["id"] == random_attack_id), None)
+    attack_info = get_attack(random_attack_id)
     
     return {
         "message": f"Niveau augmenté en {stat_name}",
-        "new_level": new_level,
+        "new_level": user["stats"][stat_name]["level"],
         "attack_gained": attack_info
     }
 
+# Attaques en attente : pagination par _id (ordre d'arrivée) et traitement par lots
+PENDING_ATTACKS_PAGE_MAX = 200
+PENDING_ATTACKS_BATCH_SIZE = int(os.environ.get('PENDING_ATTACKS_BATCH_SIZE', 500))
+APPLIED_EFFECTS_REPORT_MAX = 100
+
+def parse_object_id(value: str) -> ObjectId:
+    """Curseur de pagination -> ObjectId (400 si invalide)"""
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
+        raise HTTPException(status_code=400, detail="Curseur de pagination invalide")
+
 @api_router.get("/user/pending-attacks")
-async def get_pending_attacks(current_user: User = Depends(get_current_user)):
-    """Récupère les attaques en attente d'application pour l'utilisateur"""
-    pending = await db.attack_actions.find({"target": current_user.username, "applied": False}).to_list(100)
+async def get_pending_attacks(
+    response: Response,
+    limit: int = Query(100, ge=1, le=PENDING_ATTACKS_PAGE_MAX),
+    after: Optional[str] = None,
+    current_user: UserView = Depends(get_current_user_fields())
+):
+    """Récupère les attaques en attente d'application pour l'utilisateur (paginée avec limit/after)"""
+    query = {"target": current_user.username, "applied": False}
+    if after is not None:
+        query["_id"] = {"$gt": parse_object_id(after)}
+    
+    # Une attaque de plus que la page pour savoir s'il reste une page suivante
+    pending = await db.attack_actions.find(query).sort("_id", ASCENDING).limit(limit + 1).to_list(limit + 1)
+    if len(pending) > limit:
+        pending = pending[:limit]
+        response.headers["X-Next-Cursor"] = str(pending[-1]["_id"])
     
     attack_details = []
     for attack in pending:
-        attack_data = next((a for a in ATTACKS_DATA if a["id"] == attack["attack_id"]), None)
-        if attack_data:
-            attack_details.append({
-                "attacker": attack["attacker"],
-                "attack": attack_data,
-                "target_stat": attack.get("target_stat"),
-                "effect_target": attack.get("effect_target"),
-                "created_at": attack["created_at"]
-            })
+        event = pending_attack_event(attack)
+        if event is not None:
+            attack_details.append(event["data"])
     
     return attack_details
 
-@api_router.post("/user/apply-pending-attacks")
-async def apply_pending_attacks(current_user: User = Depends(get_current_user)):
-    """Applique toutes les attaques en attente pour l'utilisateur connecté"""
-    pending = await db.attack_actions.find({"target": current_user.username, "applied": False}).to_list(100)
+# Notifications d'attaques en temps réel (Server-Sent Events)
+# Chaque processus garde un hub en mémoire : une file bornée par connexion, indexée
+# par joueur ciblé. use_attack publie directement dans le hub local ; avec plusieurs
+# workers, ATTACK_EVENTS_CHANGE_STREAM=true fait passer la diffusion par un change
+# stream sur attack_actions (replica set requis), que chaque worker relaie à ses
+# propres connexions.
+ATTACK_EVENTS_CHANGE_STREAM = os.environ.get('ATTACK_EVENTS_CHANGE_STREAM', 'false').lower() == 'true'
+ATTACK_EVENTS_QUEUE_SIZE = int(os.environ.get('ATTACK_EVENTS_QUEUE_SIZE', 100))
+ATTACK_EVENTS_HEARTBEAT_SECONDS = 15
+ATTACK_EVENTS_RETRY_SECONDS = 5
+ATTACK_EVENTS_REPLAY_MAX = 200
+ATTACK_EVENTS_TICKET_SECONDS = int(os.environ.get('ATTACK_EVENTS_TICKET_SECONDS', 60))
+ATTACK_EVENTS_TICKET_SCOPE = "attack-events"
+
+class AttackEventHub:
+    """Pub/sub en mémoire : nom du joueur ciblé -> files des connexions ouvertes.
+
+    Les files sont bornées : si un client ne lit pas assez vite, ses événements en
+    trop sont abandonnés et il reçoit un unique événement "resync" qui lui demande
+    de relire GET /user/pending-attacks, sans jamais bloquer l'émetteur.
+    """
     
-    effects_applied = []
-    current_stats = current_user.stats.copy()
-    current_health = current_user.health
-    current_energy = current_user.energy
+    RESYNC = {"event": "resync"}
     
-    for attack in pending:
-        attack_data = next((a for a in ATTACKS_DATA if a["id"] == attack["attack_id"]), None)
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self.subscribers: Dict[str, set] = {}
+        self.delivered = 0
+        self.dropped = 0
+    
+    def subscribe(self, username: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers.setdefault(username, set()).add(queue)
+        return queue
+    
+    def unsubscribe(self, username: str, queue: asyncio.Queue):
+        queues = self.subscribers.get(username)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self.subscribers[username]
+    
+    def publish(self, username: str, event: dict):
+        for queue in self.subscribers.get(username, ()):
+            if queue.full():
+                # Client trop lent : vider sa file et lui demander de se resynchroniser
+                self.dropped += queue.qsize() + 1
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(self.RESYNC)
+            else:
+                self.delivered += 1
+                queue.put_nowait(event)
+    
+    def stats(self) -> dict:
+        return {
+            "users": len(self.subscribers),
+            "connections": sum(len(queues) for queues in self.subscribers.values()),
+            "delivered": self.delivered,
+            "dropped": self.dropped
+        }
+
+attack_event_hub = AttackEventHub(ATTACK_EVENTS_QUEUE_SIZE)
+
+def pending_attack_event(attack: dict) -> Optional[dict]:
+    """Document attack_actions -> événement "attack" (même forme que /user/pending-attacks)"""
+    attack_data = get_attack(attack["attack_id"])
+    if attack_data is None:
+        return None
+    return {
+        "event": "attack",
+        "id": str(attack["_id"]),
+        "data": {
+            "id": str(attack["_id"]),
+            "attacker": attack["attacker"],
+            "attack": attack_data,
+            "target_stat": attack.get("target_stat"),
+            "effect_target": attack.get("effect_target"),
+            "created_at": attack["created_at"]
+        }
+    }
+
+def publish_attack_actions(attacks: List[dict]):
+    """Notifie les cibles des attaques insérées (sauf si le change stream s'en charge)"""
+    if ATTACK_EVENTS_CHANGE_STREAM:
+        return
+    for attack in attacks:
+        event = pending_attack_event(attack)
+        if event is not None:
+            attack_event_hub.publish(attack["target"], event)
+
+async def run_attack_event_stream():
+    """Relaie les insertions d'attack_actions de tous les workers vers le hub local"""
+    pipeline = [{"$match": {"operationType": "insert"}}]
+    resume_token = None
+    while True:
+        try:
+            async with db.attack_actions.watch(pipeline, resume_after=resume_token) as stream:
+                async for change in stream:
+                    resume_token = stream.resume_token
+                    attack = change["fullDocument"]
+                    event = pending_attack_event(attack)
+                    if event is not None:
+                        attack_event_hub.publish(attack["target"], event)
+        except asyncio.CancelledError:
+            raise
+        except PyMongoError:
+            logger.exception("Change stream attack_actions interrompu")
+            await asyncio.sleep(ATTACK_EVENTS_RETRY_SECONDS)
+
+def server_sent_event(event: dict) -> str:
+    lines = [f"event: {event['event']}"]
+    if "id" in event:
+        lines.append(f"id: {event['id']}")
+    lines.append(f"data: {json.dumps(jsonable_encoder(event.get('data', {})))}")
+    return "\n".join(lines) + "\n\n"
+
+@api_router.post("/user/attack-events/ticket")
+async def create_attack_events_ticket(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Ticket d'ouverture du flux SSE : courte durée, valable uniquement pour /user/attack-events.
+
+    EventSource ne permet pas d'envoyer d'en-tête ; le ticket passe donc dans l'URL
+    (et les journaux d'accès) à la place du jeton de session.
+    """
+    session = decode_session_token(credentials.credentials)
+    ticket = create_access_token(
+        data={"sub": session["sub"], "scope": ATTACK_EVENTS_TICKET_SCOPE, "session_exp": session["exp"]},
+        expires_delta=timedelta(seconds=ATTACK_EVENTS_TICKET_SECONDS)
+    )
+    return {"ticket": ticket, "expires_in": ATTACK_EVENTS_TICKET_SECONDS}
+
+@api_router.get("/user/attack-events")
+async def stream_attack_events(
+    request: Request,
+    ticket: Optional[str] = None,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+):
+    """Flux SSE des attaques reçues, à la place du polling de /user/pending-attacks.
+
+    Ouvert avec un ticket (?ticket=, voir /user/attack-events/ticket) ou le jeton de
+    session en en-tête Authorization ; le flux se ferme (événement "expired") à
+    l'expiration de la session. Aucune lecture en base pendant le flux ; à la
+    reconnexion, les attaques reçues après Last-Event-ID sont rejouées (index
+    target_applied_id), ou un "resync" est envoyé s'il y en a trop ou si
+    l'identifiant est invalide.
+    """
+    if credentials is not None:
+        session = decode_session_token(credentials.credentials)
+        username, session_exp = session["sub"], session["exp"]
+    elif ticket is not None:
+        payload = decode_token(ticket)
+        if payload.get("scope") != ATTACK_EVENTS_TICKET_SCOPE:
+            raise credentials_exception()
+        username, session_exp = payload["sub"], payload["session_exp"]
+        if session_exp <= time.time():
+            raise credentials_exception()
+    else:
+        raise credentials_exception()
+    
+    # Abonnement avant la relecture : aucune attaque ne tombe entre les deux
+    queue = attack_event_hub.subscribe(username)
+    replay = []
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id:
+        try:
+            after = ObjectId(last_event_id)
+        except (InvalidId, TypeError):
+            replay = [AttackEventHub.RESYNC]
+        else:
+            try:
+                missed = await db.attack_actions.find(
+                    {"target": username, "applied": False, "_id": {"$gt": after}}
+                ).sort("_id", ASCENDING).limit(ATTACK_EVENTS_REPLAY_MAX + 1).to_list(ATTACK_EVENTS_REPLAY_MAX + 1)
+            except BaseException:
+                attack_event_hub.unsubscribe(username, queue)
+                raise
+            if len(missed) > ATTACK_EVENTS_REPLAY_MAX:
+                replay = [AttackEventHub.RESYNC]
+            else:
+                replay = [event for event in map(pending_attack_event, missed) if event is not None]
+    replayed_ids = {event["id"] for event in replay if "id" in event}
+    
+    async def events():
+        try:
+            yield f"retry: {ATTACK_EVENTS_RETRY_SECONDS * 1000}\n\n"
+            for event in replay:
+                yield server_sent_event(event)
+            while not await request.is_disconnected():
+                remaining = session_exp - time.time()
+                if remaining <= 0:
+                    yield server_sent_event({"event": "expired"})
+                    return
+                try:
+                    event = await asyncio.wait_for(queue.get(), min(ATTACK_EVENTS_HEARTBEAT_SECONDS, remaining))
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event.get("id") in replayed_ids:
+                    continue  # déjà envoyée par la relecture
+                yield server_sent_event(event)
+        finally:
+            attack_event_hub.unsubscribe(username, queue)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Attack effect engine
+# Chaque effect_type a un handler enregistré qui replie l'attaque dans un EffectDelta.
+# Le delta d'un lot d'attaques est appliqué en une seule mise à jour (pipeline) sur
+# le document utilisateur, avec les bornes à 0 calculées côté serveur.
+ATTACK_EFFECT_HANDLERS = {}
+
+def attack_effect(*effect_types: str):
+    """Enregistre un handler pour un ou plusieurs effect_type"""
+    def register(handler):
+        for effect_type in effect_types:
+            ATTACK_EFFECT_HANDLERS[effect_type] = handler
+        return handler
+    return register
+
+HEALTH_MAX = 100  # PV initiaux (User.health) : les attaques ne font que les baisser
+
+class EffectDelta:
+    """Effet cumulé d'un lot d'attaques sur un joueur.
+
+    Les pertes de PV (fixes ou en pourcentage) s'appliquent dans l'ordre des attaques,
+    avec l'arrondi entier de chaque attaque comme avant le moteur d'effets ; le
+    résultat est précalculé pour chaque valeur de PV possible. Toutes les valeurs
+    sont bornées à 0 au moment de l'écriture.
+    """
+    __slots__ = ("now", "elo", "health_ops", "energy_loss", "energy_reset", "timed_effects")
+
+    def __init__(self):
+        self.now = datetime.utcnow()
+        self.elo = {}  # stat -> variation d'ELO (négative)
+        self.health_ops = []  # ("loss", PV) ou ("percentage", %), dans l'ordre des attaques
+        self.energy_loss = 0
+        self.energy_reset = False
+        self.timed_effects = []  # entrées ActiveEffect démarrées par ce lot
+
+    def start_effect(self, attack_data: dict, target_stat: Optional[str], times: int = 1):
+        """Démarre `times` effets temporaires (attaques avec duration_hours)"""
+        effect = {
+            "attack_id": attack_data["id"],
+            "effect_type": attack_data["effect_type"],
+            "effect_value": attack_data["effect_value"],
+            "target_stat": target_stat,
+            "expires_at": self.now + timedelta(hours=attack_data["duration_hours"]),
+        }
+        self.timed_effects.extend(dict(effect) for _ in range(times))
+
+    def add_elo(self, stat_name: str, amount: int):
+        self.elo[stat_name] = self.elo.get(stat_name, 0) + amount
+
+    def lose_health(self, amount: int):
+        if self.health_ops and self.health_ops[-1][0] == "loss":
+            # Pertes fixes consécutives : max(0, max(0, h - a) - b) == max(0, h - a - b)
+            self.health_ops[-1] = ("loss", self.health_ops[-1][1] + amount)
+        else:
+            self.health_ops.append(("loss", amount))
+
+    def lose_health_percentage(self, percentage: int):
+        self.health_ops.append(("percentage", percentage))
+
+    def health_table(self) -> List[int]:
+        """PV restants pour chaque valeur de départ 0..HEALTH_MAX (calcul historique, attaque par attaque)"""
+        table = list(range(HEALTH_MAX + 1))
+        for kind, value in self.health_ops:
+            if kind == "loss":
+                table = [max(0, health - value) for health in table]
+            else:
+                table = [max(0, health - (health * value // 100)) for health in table]
+            if not table[-1]:
+                break  # plus aucun PV, quel que soit le départ
+        return table
+
+    def is_empty(self) -> bool:
+        return (
+            not any(self.elo.values())
+            and not self.health_ops
+            and not self.energy_loss
+            and not self.energy_reset
+            and not self.timed_effects
+        )
+
+    def to_update(self) -> list:
+        """Pipeline de mise à jour atomique appliquant le delta"""
+        fields = {}
+        for stat_name, amount in self.elo.items():
+            if amount:
+                path = f"stats.{stat_name}.elo"
+                fields[path] = {"$max": [0, {"$add": [f"${path}", amount]}]}
+        if len(self.health_ops) == 1 and self.health_ops[0][0] == "loss":
+            fields["health"] = {"$max": [0, {"$subtract": ["$health", self.health_ops[0][1]]}]}
+        elif self.health_ops:
+            # Table des PV finaux indexée par les PV actuels (0..HEALTH_MAX)
+            fields["health"] = {"$arrayElemAt": [
+                {"$literal": self.health_table()},
+                {"$min": [HEALTH_MAX, {"$max": [0, {"$toInt": {"$ifNull": ["$health", HEALTH_MAX]}}]}]},
+            ]}
+        if self.energy_reset:
+            fields["energy"] = 0
+        elif self.energy_loss:
+            fields["energy"] = {"$max": [0, {"$subtract": ["$energy", self.energy_loss]}]}
+        if self.timed_effects:
+            # Vue des effets actifs : on retire les entrées expirées et on ajoute les nouvelles
+            fields["active_effects"] = {"$concatArrays": [
+                {"$filter": {
+                    "input": {"$ifNull": ["$active_effects", []]},
+                    "cond": {"$gt": ["$$this.expires_at", self.now]}
+                }},
+                {"$literal": self.timed_effects},
+            ]}
+        return [{"$set": fields}]
+
+@attack_effect("elo_loss", "elo_poison")
+def _effect_elo_loss(delta: EffectDelta, effect_value: int, target_stat: Optional[str]):
+    if target_stat in STAT_NAMES:
+        delta.add_elo(target_stat, -effect_value)
+    else:
+        # Appliquer sur toutes les stats
+        for stat_name in STAT_NAMES:
+            delta.add_elo(stat_name, -effect_value)
+
+@attack_effect("elo_steal")
+def _effect_elo_steal(delta: EffectDelta, effect_value: int, target_stat: Optional[str]):
+    if target_stat in STAT_NAMES:
+        delta.add_elo(target_stat, -effect_value)
+        # Créditer l'attaquant (à implémenter si nécessaire)
+
+@attack_effect("health_loss")
+def _effect_health_loss(delta: EffectDelta, effect_value: int, target_stat: Optional[str]):
+    delta.lose_health(effect_value)
+
+@attack_effect("health_percentage")
+def _effect_health_percentage(delta: EffectDelta, effect_value: int, target_stat: Optional[str]):
+    delta.lose_health_percentage(effect_value)
+
+@attack_effect("energy_drain", "energy_steal")
+def _effect_energy_drain(delta: EffectDelta, effect_value: int, target_stat: Optional[str]):
+    delta.energy_loss += effect_value
+
+@attack_effect("energy_reset")
+def _effect_energy_reset(delta: EffectDelta, effect_value: int, target_stat: Optional[str]):
+    delta.energy_reset = True
+
+def fold_attack(delta: EffectDelta, attack_data: dict, target_stat: Optional[str], times: int = 1):
+    """Replie `times` occurrences d'une même attaque dans le delta"""
+    handler = ATTACK_EFFECT_HANDLERS.get(attack_data["effect_type"])
+    if handler:
+        for _ in range(times):
+            handler(delta, attack_data["effect_value"], target_stat)
+    if attack_data.get("duration_hours"):
+        delta.start_effect(attack_data, target_stat, times)
+
+def fold_attacks(attacks: List[dict]):
+    """Replie une liste d'attack_actions en un EffectDelta et la liste des effets à afficher"""
+    delta = EffectDelta()
+    effects_applied = []
+    for attack in attacks:
+        attack_data = get_attack(attack["attack_id"])
         if not attack_data:
             continue
-            
-        effect_type = attack_data["effect_type"]
-        effect_value = attack_data["effect_value"]
-        target_stat = attack.get("target_stat")
-        effect_target = attack.get("effect_target", "elo")
-        
-        # Appliquer l'effet selon le type
-        if effect_type == "elo_loss":
-            if target_stat and target_stat in current_stats:
-                current_stats[target_stat]["elo"] = max(0, current_stats[target_stat]["elo"] - effect_value)
-            else:
-                # Appliquer sur toutes les stats
-                for stat_name in current_stats:
-                    current_stats[stat_name]["elo"] = max(0, current_stats[stat_name]["elo"] - effect_value)
-        
-        elif effect_type == "elo_steal":
-            if target_stat and target_stat in current_stats:
-                stolen = min(effect_value, current_stats[target_stat]["elo"])
-                current_stats[target_stat]["elo"] -= stolen
-                # Créditer l'attaquant (à implémenter si nécessaire)
         
-        elif effect_type == "health_loss":
-            current_health = max(0, current_health - effect_value)
-        
-        elif effect_type == "health_percentage":
-            current_health = max(0, current_health - (current_health * effect_value // 100))
-        
-        elif effect_type == "energy_drain":
-            current_energy = max(0, current_energy - effect_value)
-        
-        elif effect_type == "energy_reset":
-            current_energy = 0
-        
-        elif effect_type == "energy_steal":
-            stolen = min(effect_value, current_energy)
-            current_energy -= stolen
+        fold_attack(delta, attack_data, attack.get("target_stat"))
         
         effects_applied.append({
             "attack_name": attack_data["name"],
             "attacker": attack["attacker"],
             "effect": attack_data["description"]
         })
-    
-    # Mettre à jour l'utilisateur en base
-    await db.users.update_one(
-        {"username": current_user.username},
-        {
-            "$set": {
-                "stats": current_stats,
-                "health": current_health,
-                "energy": current_energy
-            }
+    return delta, effects_applied
+
+# Effets temporaires
+# Les attaques avec duration_hours démarrent un effet stocké dans active_effects
+# (expiration par index TTL) et recopié dans user.active_effects, la vue lue par
+# les routes sans requête supplémentaire. Les effets récurrents (elo_poison) sont
+# rangés dans les cases d'une roue temporelle (tick_slot, une case par minute) :
+# chaque tick réserve en bloc les effets des cases échues et les applique en un bulk_write.
+TIMING_WHEEL_SLOT_SECONDS = 60
+TIMED_EFFECTS_ENABLED = os.environ.get('TIMED_EFFECTS_ENABLED', 'true').lower() == 'true'
+RECURRING_EFFECT_PERIOD_HOURS = MappingProxyType({"elo_poison": 24})
+ATTACK_BLOCKING_EFFECTS = ("card_block", "attack_silence")
+EPOCH = datetime(1970, 1, 1)
+
+def effect_slot(moment: datetime) -> int:
+    """Case de la roue temporelle contenant cet instant (UTC)"""
+    return int((moment - EPOCH).total_seconds()) // TIMING_WHEEL_SLOT_SECONDS
+
+def active_effect_documents(target: str, delta: EffectDelta, batch_id: str) -> List[dict]:
+    """Documents active_effects des effets démarrés par un delta.
+
+    Le premier tick d'un effet récurrent est compris dans le delta : les suivants
+    sont programmés une période plus tard, jusqu'à l'expiration.
+    """
+    documents = []
+    for index, effect in enumerate(delta.timed_effects):
+        document = {
+            **effect, "_id": f"{batch_id}:{target}:{index}",
+            "target": target, "started_at": delta.now, "apply_batch": batch_id
         }
+        period_hours = RECURRING_EFFECT_PERIOD_HOURS.get(effect["effect_type"])
+        if period_hours:
+            duration = effect["expires_at"] - delta.now
+            document["ticks_left"] = int(duration / timedelta(hours=period_hours)) - 1
+            document["tick_slot"] = effect_slot(delta.now + timedelta(hours=period_hours))
+        documents.append(document)
+    return documents
+
+def live_effects(active_effects: Optional[List[ActiveEffect]], now: Optional[datetime] = None) -> List[ActiveEffect]:
+    now = now or datetime.utcnow()
+    return [effect for effect in active_effects or [] if effect.expires_at > now]
+
+def effective_modifiers(active_effects: Optional[List[ActiveEffect]]) -> dict:
+    """Modificateurs effectifs par effect_type (valeurs cumulées des effets non expirés)"""
+    modifiers = {}
+    for effect in live_effects(active_effects):
+        modifier = modifiers.setdefault(effect.effect_type, {"value": 0, "target_stats": [], "expires_at": effect.expires_at})
+        modifier["value"] += effect.effect_value
+        if effect.target_stat and effect.target_stat not in modifier["target_stats"]:
+            modifier["target_stats"].append(effect.target_stat)
+        modifier["expires_at"] = max(modifier["expires_at"], effect.expires_at)
+    return modifiers
+
+def attack_blocked(active_effects: Optional[List[ActiveEffect]], target_stat: Optional[str]) -> bool:
+    """Vrai si un effet actif empêche d'envoyer une attaque (sur cette stat)"""
+    return any(
+        effect.effect_type in ATTACK_BLOCKING_EFFECTS
+        or (effect.effect_type == "attack_block" and effect.target_stat in (None, target_stat))
+        for effect in live_effects(active_effects)
     )
+
+def attack_block_filter(now: datetime, *target_stats: Optional[str]) -> dict:
+    """Condition de requête sur active_effects : aucun effet actif ne bloque ces stats"""
+    return {"$not": {"$elemMatch": {
+        "expires_at": {"$gt": now},
+        "$or": [
+            {"effect_type": {"$in": list(ATTACK_BLOCKING_EFFECTS)}},
+            {"effect_type": "attack_block", "target_stat": {"$in": [None, *target_stats]}},
+        ]
+    }}}
+
+async def tick_recurring_effects(now: Optional[datetime] = None) -> int:
+    """Avance la roue temporelle : applique en bloc les ticks des effets récurrents échus"""
+    slot = effect_slot(now or datetime.utcnow())
+    batch_id = str(uuid.uuid4())
+    for effect_type, period_hours in RECURRING_EFFECT_PERIOD_HOURS.items():
+        # Réservation : chaque effet échu avance d'une période (les ticks manqués sont rattrapés aux tours suivants)
+        await db.active_effects.update_many(
+            {"effect_type": effect_type, "ticks_left": {"$gt": 0}, "tick_slot": {"$lte": slot}},
+            {
+                "$inc": {"tick_slot": period_hours * 3600 // TIMING_WHEEL_SLOT_SECONDS, "ticks_left": -1},
+                "$set": {"tick_batch": batch_id}
+            }
+        )
+    
+    deltas = {}
+    total_ticks = 0
+    async for group in db.active_effects.aggregate([
+        {"$match": {"tick_batch": batch_id}},
+        {"$group": {
+            "_id": {
+                "target": "$target",
+                "effect_type": "$effect_type",
+                "effect_value": "$effect_value",
+                "target_stat": "$target_stat"
+            },
+            "count": {"$sum": 1}
+        }},
+    ]):
+        key = group["_id"]
+        handler = ATTACK_EFFECT_HANDLERS.get(key["effect_type"])
+        if not handler:
+            continue
+        delta = deltas.setdefault(key["target"], EffectDelta())
+        for _ in range(group["count"]):
+            handler(delta, key["effect_value"], key.get("target_stat"))
+        total_ticks += group["count"]
+    
+    requests = [
+        UpdateOne({"username": target}, delta.to_update())
+        for target, delta in deltas.items() if not delta.is_empty()
+    ]
+    if requests:
+        await db.users.bulk_write(requests, ordered=False)
+        await reload_elos([target for target, delta in deltas.items() if delta.elo])
+    for target in deltas:
+        user_cache.invalidate(target)
+    return total_ticks
+
+async def run_timed_effects_scheduler():
+    """Tick de la roue temporelle au début de chaque case"""
+    while True:
+        try:
+            await tick_recurring_effects()
+        except PyMongoError:
+            logger.exception("Tick des effets temporaires interrompu")
+        await asyncio.sleep(TIMING_WHEEL_SLOT_SECONDS - time.time() % TIMING_WHEEL_SLOT_SECONDS)
+
+# Un lot réservé garde apply_pending tant que son delta n'est pas écrit sur le joueur :
+# sans transaction, une écriture échouée (délai dépassé, worker arrêté) laisse le lot
+# rejouable par l'appel suivant du joueur ou par la résolution de minuit. Le joueur
+# mémorise ses derniers lots écrits (apply_batches), ce qui rend la réécriture idempotente.
+APPLY_BATCH_HISTORY = 20
+APPLY_BATCH_REPLAY_AFTER_SECONDS = 300
+
+async def insert_active_effects(documents: List[dict], session=None):
+    """Insère des effets temporaires à _id déterministe (les doublons d'un lot rejoué sont ignorés)"""
+    try:
+        await db.active_effects.insert_many(documents, ordered=False, session=session)
+    except BulkWriteError as exc:
+        if any(error["code"] != 11000 for error in exc.details["writeErrors"]):
+            raise
+
+async def write_attack_batch(username: str, batch_id: str, attacks: List[dict], session=None):
+    """Applique le delta d'un lot réservé au joueur (au plus une fois par batch_id), puis le confirme"""
+    delta, effects_applied = fold_attacks(attacks)
+    if not delta.is_empty():
+        update = delta.to_update()
+        update[0]["$set"]["apply_batches"] = {"$concatArrays": [
+            {"$slice": [{"$ifNull": ["$apply_batches", []]}, 1 - APPLY_BATCH_HISTORY]},
+            [batch_id],
+        ]}
+        user = await db.users.find_one_and_update(
+            {"username": username, "apply_batches": {"$ne": batch_id}}, update,
+            projection=LEADERBOARD_ELO_PROJECTION, return_document=ReturnDocument.AFTER, session=session
+        )
+        if user and delta.elo:
+            record_elos([user])
+    if delta.timed_effects:
+        await insert_active_effects(active_effect_documents(username, delta, batch_id), session=session)
+    await db.attack_actions.update_many(
+        {"apply_batch": batch_id, "apply_pending": True}, {"$unset": {"apply_pending": ""}}, session=session
+    )
+    return effects_applied
+
+async def replay_unwritten_attack_batches(match: dict) -> int:
+    """Réécrit les lots réservés dont l'écriture n'a pas été confirmée ; retourne le nombre de lots"""
+    batches = {}
+    async for attack in db.attack_actions.find({**match, "apply_pending": True}).sort("_id", ASCENDING):
+        batches.setdefault((attack["target"], attack["apply_batch"]), []).append(attack)
+    for (target, batch_id), attacks in batches.items():
+        logger.warning("Lot d'attaques %s non confirmé pour %s : réécriture", batch_id, target)
+        await write_attack_batch(target, batch_id, attacks)
+        user_cache.invalidate(target)
+    return len(batches)
+
+async def claim_and_apply_attacks(username: str, attacks: List[dict]):
+    """Marque exactement ces attaques comme appliquées puis applique leur delta en une mise à jour.
+
+    Les attaques sont d'abord réservées avec un identifiant de lot : si un autre
+    appel en a déjà appliqué certaines, seules celles réservées ici comptent.
+    """
+    if not attacks:
+        return []
+    
+    batch_id = str(uuid.uuid4())
+    attack_ids = [attack["_id"] for attack in attacks]
+    async with mongo_transaction() as session:
+        claim = await db.attack_actions.update_many(
+            {"_id": {"$in": attack_ids}, "applied": False},
+            {"$set": {
+                "applied": True, "applied_at": datetime.utcnow(), "apply_batch": batch_id, "apply_pending": True
+            }},
+            session=session
+        )
+        if claim.modified_count != len(attack_ids):
+            claimed_ids = set(await db.attack_actions.distinct(
+                "_id", {"apply_batch": batch_id}, session=session
+            ))
+            attacks = [attack for attack in attacks if attack["_id"] in claimed_ids]
+        
+        effects_applied = await write_attack_batch(username, batch_id, attacks, session=session)
+    
+    user_cache.invalidate(username)
+    return effects_applied
+
+@api_router.get("/user/effects")
+async def get_active_effects(current_user: UserView = Depends(get_current_user_fields("active_effects"))):
+    """Effets temporaires actifs sur l'utilisateur et modificateurs effectifs"""
+    effects = []
+    for effect in live_effects(current_user.active_effects):
+        attack_data = get_attack(effect.attack_id)
+        effects.append({**effect.dict(), "attack_name": attack_data["name"] if attack_data else None})
+    
+    return {"effects": effects, "modifiers": effective_modifiers(current_user.active_effects)}
+
+@api_router.post("/user/apply-pending-attacks")
+@mongo_time_budget(MONGO_BULK_TIMEOUT_MS)
+async def apply_pending_attacks(current_user: UserView = Depends(get_current_user_fields())):
+    """Applique toutes les attaques en attente pour l'utilisateur connecté.
+
+    Les attaques sont lues en flux (curseur trié par _id) et appliquées par lots de
+    PENDING_ATTACKS_BATCH_SIZE ; seuls les APPLIED_EFFECTS_REPORT_MAX premiers effets
+    sont détaillés dans la réponse, total_attacks compte tous les effets appliqués.
+    """
+    await replay_unwritten_attack_batches({"target": current_user.username})
+    
+    effects_applied = []
+    total_attacks = 0
+    
+    async def apply_batch(batch):
+        nonlocal total_attacks
+        batch_effects = await claim_and_apply_attacks(current_user.username, batch)
+        total_attacks += len(batch_effects)
+        effects_applied.extend(batch_effects[:APPLIED_EFFECTS_REPORT_MAX - len(effects_applied)])
+    
+    cursor = db.attack_actions.find(
+        {"target": current_user.username, "applied": False}
+    ).sort("_id", ASCENDING).batch_size(PENDING_ATTACKS_BATCH_SIZE)
     
-    # Marquer les attaques comme appliquées
+    batch = []
+    async for attack in cursor:
+        batch.append(attack)
+        if len(batch) == PENDING_ATTACKS_BATCH_SIZE:
+            await apply_batch(batch)
+            batch = []
+    if batch:
+        await apply_batch(batch)
+    
+    return {"effects_applied": effects_applied, "total_attacks": total_attacks}
+
+# Résolution de minuit
+# Un job de fond applique chaque nuit les attaques en attente de tous les joueurs.
+# Les cibles sont parcourues dans l'ordre (agrégation $group) par paquets de
+# ATTACK_RESOLVER_CHUNK_SIZE : chaque paquet est réservé (apply_batch), agrégé par
+# (cible, attaque, stat), puis écrit en un seul bulk_write. Le point de reprise est
+# enregistré dans job_checkpoints après chaque paquet ; un bail (lease) garantit
+# qu'un seul worker exécute le job.
+ATTACK_RESOLVER_ENABLED = os.environ.get('ATTACK_RESOLVER_ENABLED', 'true').lower() == 'true'
+ATTACK_RESOLVER_CHUNK_SIZE = int(os.environ.get('ATTACK_RESOLVER_CHUNK_SIZE', 1000))
+ATTACK_RESOLVER_LEASE_SECONDS = int(os.environ.get('ATTACK_RESOLVER_LEASE_SECONDS', 300))
+ATTACK_RESOLVER_RETRY_SECONDS = 60
+ATTACK_RESOLVER_JOB = "attack_resolver"
+
+def last_midnight(now: datetime) -> datetime:
+    return datetime.combine(now.date(), datetime.min.time())
+
+async def acquire_resolver_lease(owner: str) -> bool:
+    """Prend ou prolonge le bail du job ; False si un autre worker le détient"""
+    now = datetime.utcnow()
+    try:
+        await db.job_checkpoints.update_one(
+            {"_id": ATTACK_RESOLVER_JOB, "$or": [
+                {"lease_until": {"$exists": False}},  # checkpoint écrit avant toute prise de bail
+                {"lease_until": {"$lt": now}},
+                {"lease_owner": owner}
+            ]},
+            {"$set": {"lease_owner": owner, "lease_until": now + timedelta(seconds=ATTACK_RESOLVER_LEASE_SECONDS)}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return False
+    return True
+
+async def release_resolver_lease(owner: str):
+    await db.job_checkpoints.update_one(
+        {"_id": ATTACK_RESOLVER_JOB, "lease_owner": owner},
+        {"$set": {"lease_until": datetime.utcnow()}}
+    )
+
+async def resolve_attack_chunk(batch_id: str, cutoff: ObjectId, targets: List[str], replay: bool = False):
+    """Réserve, agrège et applique les attaques d'un paquet de cibles.
+
+    Rejouable : la réservation ne prend que les attaques non appliquées, et chaque
+    joueur n'est mis à jour qu'une fois par batch_id (champ resolver_batch).
+    """
     await db.attack_actions.update_many(
-        {"target": current_user.username, "applied": False},
-        {"$set": {"applied": True, "applied_at": datetime.utcnow()}}
+        {"target": {"$in": targets}, "applied": False, "_id": {"$lt": cutoff}},
+        {"$set": {"applied": True, "applied_at": datetime.utcnow(), "apply_batch": batch_id}}
     )
     
-    return {"effects_applied": effects_applied, "total_attacks": len(pending)}
+    deltas = {}
+    total_attacks = 0
+    async for group in db.attack_actions.aggregate([
+        {"$match": {"apply_batch": batch_id}},
+        {"$group": {
+            "_id": {"target": "$target", "attack_id": "$attack_id", "target_stat": "$target_stat"},
+            "count": {"$sum": 1}
+        }},
+    ]):
+        key = group["_id"]
+        delta = deltas.setdefault(key["target"], EffectDelta())
+        total_attacks += group["count"]
+        attack_data = get_attack(key["attack_id"])
+        if attack_data:
+            fold_attack(delta, attack_data, key.get("target_stat"), group["count"])
+    
+    requests = []
+    timed_effects = []
+    for target, delta in deltas.items():
+        if delta.is_empty():
+            continue
+        update = delta.to_update()
+        update[0]["$set"]["resolver_batch"] = batch_id
+        requests.append(UpdateOne({"username": target, "resolver_batch": {"$ne": batch_id}}, update))
+        timed_effects.extend(active_effect_documents(target, delta, batch_id))
+    if requests:
+        await db.users.bulk_write(requests, ordered=False)
+        await reload_elos([target for target, delta in deltas.items() if delta.elo])
+    if replay:
+        await db.active_effects.delete_many({"apply_batch": batch_id})
+    if timed_effects:
+        await db.active_effects.insert_many(timed_effects, ordered=False)
+    
+    for target in targets:
+        user_cache.invalidate(target)
+    return len(deltas), total_attacks
+
+async def resolve_pending_attacks(owner: Optional[str] = None):
+    """Applique les attaques en attente de tous les joueurs, en reprenant un passage interrompu.
+
+    Avec `owner`, le bail est prolongé à chaque paquet et le passage s'arrête s'il est perdu.
+    Retourne False si le passage a été interrompu.
+    """
+    # Lots réservés par /user/apply-pending-attacks dont l'écriture a échoué
+    await replay_unwritten_attack_batches({
+        "applied_at": {"$lt": datetime.utcnow() - timedelta(seconds=APPLY_BATCH_REPLAY_AFTER_SECONDS)}
+    })
+    
+    checkpoint = await db.job_checkpoints.find_one({"_id": ATTACK_RESOLVER_JOB}) or {}
+    run = checkpoint.get("run")
+    if not run:
+        started_at = datetime.utcnow()
+        run = {
+            "cutoff": ObjectId.from_datetime(started_at),
+            "started_at": started_at,
+            "last_target": None,
+            "pending": None,
+            "users": 0,
+            "attacks": 0,
+        }
+        await db.job_checkpoints.update_one({"_id": ATTACK_RESOLVER_JOB}, {"$set": {"run": run}}, upsert=True)
+    cutoff = run["cutoff"]
+    
+    async def commit_chunk(batch_id, targets, replay=False):
+        await db.job_checkpoints.update_one(
+            {"_id": ATTACK_RESOLVER_JOB},
+            {"$set": {"run.pending": {"batch_id": batch_id, "targets": targets}}}
+        )
+        users, attacks = await resolve_attack_chunk(batch_id, cutoff, targets, replay)
+        run["users"] += users
+        run["attacks"] += attacks
+        await db.job_checkpoints.update_one(
+            {"_id": ATTACK_RESOLVER_JOB},
+            {"$set": {"run.last_target": targets[-1], "run.pending": None}, "$inc": {"run.users": users, "run.attacks": attacks}}
+        )
+    
+    # Paquet réservé mais non confirmé avant l'interruption : le rejouer
+    if run["pending"]:
+        await commit_chunk(run["pending"]["batch_id"], run["pending"]["targets"], replay=True)
+    
+    match = {"applied": False, "_id": {"$lt": cutoff}}
+    if run["last_target"] is not None:
+        match["target"] = {"$gt": run["last_target"]}
+    
+    targets = []
+    async for group in db.attack_actions.aggregate(
+        [{"$match": match}, {"$group": {"_id": "$target"}}, {"$sort": {"_id": ASCENDING}}],
+        allowDiskUse=True
+    ):
+        targets.append(group["_id"])
+        if len(targets) == ATTACK_RESOLVER_CHUNK_SIZE:
+            if owner and not await acquire_resolver_lease(owner):
+                logger.warning("Bail de la résolution de minuit perdu, passage interrompu")
+                return False
+            await commit_chunk(str(uuid.uuid4()), targets)
+            targets = []
+    if targets:
+        await commit_chunk(str(uuid.uuid4()), targets)
+    
+    duration = (datetime.utcnow() - run["started_at"]).total_seconds()
+    await db.job_checkpoints.update_one(
+        {"_id": ATTACK_RESOLVER_JOB},
+        {"$set": {
+            "run": None,
+            "last_cutoff_at": cutoff.generation_time.replace(tzinfo=None),
+            "last_run": {"users": run["users"], "attacks": run["attacks"], "duration_seconds": duration},
+        }}
+    )
+    logger.info(
+        "Résolution de minuit : %d attaques appliquées à %d joueurs en %.1fs",
+        run["attacks"], run["users"], duration
+    )
+    return True
+
+def resolver_done_today(checkpoint: dict) -> bool:
+    last_cutoff_at = checkpoint.get("last_cutoff_at")
+    return last_cutoff_at is not None and last_cutoff_at >= last_midnight(datetime.utcnow())
+
+async def run_attack_resolver():
+    """Boucle du job : reprend un passage interrompu ou manqué, sinon attend minuit (UTC)"""
+    owner = str(uuid.uuid4())
+    woke_at_midnight = False
+    while True:
+        try:
+            checkpoint = await db.job_checkpoints.find_one({"_id": ATTACK_RESOLVER_JOB}) or {}
+            first_run = "last_cutoff_at" not in checkpoint and not woke_at_midnight
+            if not checkpoint.get("run") and (resolver_done_today(checkpoint) or first_run):
+                next_run = last_midnight(datetime.utcnow()) + timedelta(days=1)
+                await asyncio.sleep((next_run - datetime.utcnow()).total_seconds())
+                woke_at_midnight = True
+                continue
+            
+            if not await acquire_resolver_lease(owner):
+                # Un autre worker exécute le passage
+                await asyncio.sleep(ATTACK_RESOLVER_LEASE_SECONDS)
+                continue
+            try:
+                checkpoint = await db.job_checkpoints.find_one({"_id": ATTACK_RESOLVER_JOB}) or {}
+                if checkpoint.get("run") or not resolver_done_today(checkpoint):
+                    await resolve_pending_attacks(owner)
+                woke_at_midnight = False
+            finally:
+                await release_resolver_lease(owner)
+        except PyMongoError:
+            logger.exception("Résolution de minuit interrompue, nouvel essai dans %ds", ATTACK_RESOLVER_RETRY_SECONDS)
+            await asyncio.sleep(ATTACK_RESOLVER_RETRY_SECONDS)
 
 @api_router.get("/user/titles")
-async def get_user_titles(current_user: User = Depends(get_current_user)):
+async def get_user_titles(current_user: UserView = Depends(get_current_user_fields("stats", "current_title"))):
     """Récupère les titres disponibles pour l'utilisateur selon son niveau"""
     # Calculer le niveau total de l'utilisateur
     total_level = sum(stat["level"] for stat in current_user.stats.values())
     
-    available_titles = []
-    for title in TITLES_DATA:
-        if total_level >= title["level_required"]:
-            available_titles.append({
-                **title,
-                "unlocked": True,
-                "current": title["name"] == current_user.current_title
-            })
-        else:
-            available_titles.append({
-                **title,
-                "unlocked": False,
-                "current": False
-            })
+    unlocked_count = count_unlocked_titles(total_level)
+    available_titles = [
+        {
+            **title,
+            "unlocked": index < unlocked_count,
+            "current": index < unlocked_count and title["name"] == current_user.current_title
+        }
+        for index, title in enumerate(TITLES_SORTED)
+    ]
     
     return {
         "total_level": total_level,
@@ -494,13 +2948,13 @@ async def get_user_titles(current_user: User = Depends(get_current_user)):
     }
 
 @api_router.post("/user/select-title")
-async def select_title(title_name: str, current_user: User = Depends(get_current_user)):
+async def select_title(title_name: str, current_user: UserView = Depends(get_current_user_fields("stats"))):
     """Permet à l'utilisateur de choisir un titre"""
     # Calculer le niveau total
     total_level = sum(stat["level"] for stat in current_user.stats.values())
     
     # Vérifier que le titre est disponible
-    title = next((t for t in TITLES_DATA if t["name"] == title_name), None)
+    title = get_title(title_name)
     if not title:
         raise HTTPException(status_code=404, detail="Titre non trouvé")
     
@@ -512,6 +2966,7 @@ async def select_title(title_name: str, current_user: User = Depends(get_current
         {"username": current_user.username},
         {"$set": {"current_title": title_name}}
     )
+    user_cache.invalidate(current_user.username)
     
     return {"message": f"Titre '{title_name}' sélectionné", "title": title}
 
@@ -527,14 +2982,23 @@ async def register(user_data: UserCreate):
             raise HTTPException(status_code=400, detail="Email déjà utilisé")
     
     # Créer le nouvel utilisateur
-    hashed_password = get_password_hash(user_data.password)
+    hashed_password = await password_hasher.hash(user_data.password)
     user_dict = User(
         username=user_data.username,
         email=user_data.email
     ).dict()
     user_dict["password"] = hashed_password
+    user_dict.update(user_search_fields(user_data.username))
     
-    await db.users.insert_one(user_dict)
+    try:
+        await db.users.insert_one(user_dict)
+    except DuplicateKeyError as exc:
+        # Inscription concurrente passée entre la vérification et l'insertion
+        if "email" in (exc.details or {}).get("keyPattern", {}):
+            raise HTTPException(status_code=400, detail="Email déjà utilisé")
+        raise HTTPException(status_code=400, detail="Nom d'utilisateur déjà pris")
+    record_elos([user_dict])
+    presence_tracker.beat(user_data.username)
     
     # Créer le token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -548,18 +3012,19 @@ async def register(user_data: UserCreate):
 async def login(user_data: UserLogin):
     # Trouver l'utilisateur
     user = await db.users.find_one({"username": user_data.username})
-    if not user or not verify_password(user_data.password, user["password"]):
+    if not user or not await password_hasher.verify(user_data.password, user["password"]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Nom d'utilisateur ou mot de passe incorrect",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    # Mettre à jour le statut en ligne
-    await db.users.update_one(
-        {"username": user_data.username},
-        {"$set": {"is_online": True, "last_login": datetime.utcnow()}}
-    )
+    # La présence est suivie en mémoire ; seule la date de connexion est écrite
+    now = datetime.utcnow()
+    await db.users.update_one({"username": user_data.username}, {"$set": {"last_login": now}})
+    presence_tracker.beat(user_data.username, now)
+    user_cache.invalidate(user_data.username)
+    mark_club_stats_dirty(user.get("club_id"))
     
     # Créer le token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -570,82 +3035,101 @@ async def login(user_data: UserLogin):
     return {"access_token": access_token, "token_type": "bearer"}
 
 @api_router.get("/auth/me", response_model=UserProfile)
-async def get_me(current_user: User = Depends(get_current_user)):
+async def get_me(current_user: UserView = Depends(get_current_user_fields("id", "stats", "last_login", "last_seen", "online_until"))):
     return UserProfile(
         id=current_user.id,
         username=current_user.username,
         stats=current_user.stats,
-        is_online=current_user.is_online,
-        last_login=current_user.last_login
+        is_online=presence_tracker.is_online(current_user.username, current_user.online_until),
+        last_login=current_user.last_login,
+        last_seen=presence_tracker.last_seen(current_user.username, current_user.last_seen)
     )
 
 @api_router.post("/auth/logout")
-async def logout(current_user: User = Depends(get_current_user)):
-    # Mettre à jour le statut hors ligne
-    await db.users.update_one(
-        {"username": current_user.username},
-        {"$set": {"is_online": False}}
-    )
+async def logout(current_user: UserView = Depends(get_current_user_fields("club_id"))):
+    # Hors ligne immédiatement sur ce worker, écrit en base au prochain flush
+    presence_tracker.leave(current_user.username)
+    mark_club_stats_dirty(current_user.club_id)
     return {"message": "Déconnexion réussie"}
 
+@api_router.post("/user/heartbeat")
+async def heartbeat(username: str = Depends(get_current_username)):
+    """Battement de présence : aucune lecture ni écriture en base (flush périodique)"""
+    online_until = presence_tracker.beat(username)
+    return {"online_until": online_until, "heartbeat_seconds": PRESENCE_HEARTBEAT_SECONDS}
+
 # User management endpoints
+@api_router.get("/users/search", response_model=UserSearchResults)
+async def search_users_ranked(
+    q: str,
+    limit: int = Query(20, ge=1, le=USER_SEARCH_PAGE_MAX),
+    after: Optional[str] = None,
+    fuzzy: bool = True,
+    current_user: UserView = Depends(get_current_user_fields())
+):
+    """Recherche de joueurs classée et paginée (préfixe puis correspondances approchées)"""
+    results, next_cursor = await search_users(q, limit, after, fuzzy)
+    return UserSearchResults(results=results, next_cursor=next_cursor)
+
 @api_router.get("/users/search/{username}")
-async def search_user(username: str, current_user: User = Depends(get_current_user)):
-    user = await db.users.find_one({"username": {"$regex": username, "$options": "i"}})
-    if not user:
+async def search_user(username: str, current_user: UserView = Depends(get_current_user_fields())):
+    """Renvoie le meilleur résultat de recherche (nom exact, sinon préfixe, sinon approché)"""
+    results, _ = await search_users(username, limit=1)
+    if not results:
         raise HTTPException(status_code=404, detail="Utilisateur non trouvé")
     
-    return UserProfile(
-        id=user["id"],
-        username=user["username"],
-        stats=user["stats"],
-        is_online=user.get("is_online", False),
-        last_login=user.get("last_login")
-    )
+    return results[0]
 
 @api_router.post("/user/add-friend")
-async def add_friend(friend_username: str, current_user: User = Depends(get_current_user)):
+async def add_friend(friend_username: str, username: str = Depends(get_current_username)):
     """Ajoute un ami à la liste d'amis de l'utilisateur"""
-    if friend_username == current_user.username:
+    if friend_username == username:
         raise HTTPException(status_code=400, detail="Vous ne pouvez pas vous ajouter vous-même")
     
     # Vérifier que l'ami existe
-    friend = await db.users.find_one({"username": friend_username})
+    friend = await db.users.find_one({"username": friend_username}, {"_id": 1})
     if not friend:
         raise HTTPException(status_code=404, detail="Utilisateur non trouvé")
     
-    # Vérifier que l'ami n'est pas déjà dans la liste
-    if friend_username in current_user.friends:
-        raise HTTPException(status_code=400, detail="Cet utilisateur est déjà votre ami")
-    
-    # Ajouter l'ami
-    await db.users.update_one(
-        {"username": current_user.username},
-        {"$push": {"friends": friend_username}}
+    # Ajouter l'ami ($addToSet : un doublon ne modifie pas le document)
+    result = await db.users.update_one(
+        {"username": username},
+        {"$addToSet": {"friends": friend_username}}
     )
+    if result.matched_count == 0:
+        raise credentials_exception()
+    if result.modified_count == 0:
+        raise HTTPException(status_code=400, detail="Cet utilisateur est déjà votre ami")
+    user_cache.invalidate(username)
+    friends_leaderboard_cache.invalidate(username)
     
     return {"message": f"{friend_username} ajouté à vos amis"}
 
 @api_router.get("/user/friends")
-async def get_friends(current_user: User = Depends(get_current_user)):
-    """Récupère la liste des amis avec leurs stats"""
-    friends_data = []
-    
-    for friend_username in current_user.friends:
-        friend = await db.users.find_one({"username": friend_username})
-        if friend:
-            friends_data.append(UserProfile(
-                id=friend["id"],
-                username=friend["username"],
-                stats=friend["stats"],
-                is_online=friend.get("is_online", False),
-                last_login=friend.get("last_login")
-            ))
+async def get_friends(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=FRIENDS_PAGE_MAX),
+    after: Optional[str] = None,
+    current_user: UserView = Depends(get_current_user_fields("friends"))
+):
+    """Récupère la liste des amis avec leurs stats (paginée avec limit/after)"""
+    friends = current_user.friends or []
+    
+    start = 0
+    if after is not None:
+        if after not in friends:
+            raise HTTPException(status_code=400, detail="Curseur de pagination invalide")
+        start = friends.index(after) + 1
     
-    return friends_data
+    page = friends[start:start + limit] if limit else friends[start:]
+    if page and start + len(page) < len(friends):
+        # Curseur de la page suivante : dernier ami de cette page
+        response.headers["X-Next-Cursor"] = page[-1]
+    
+    return await load_user_profiles(page)
 
 @api_router.delete("/user/remove-friend")
-async def remove_friend(friend_username: str, current_user: User = Depends(get_current_user)):
+async def remove_friend(friend_username: str, current_user: UserView = Depends(get_current_user_fields("friends"))):
     """Retire un ami de la liste d'amis"""
     if friend_username not in current_user.friends:
         raise HTTPException(status_code=404, detail="Cet utilisateur n'est pas votre ami")
@@ -654,14 +3138,54 @@ async def remove_friend(friend_username: str, current_user: User = Depends(get_c
         {"username": current_user.username},
         {"$pull": {"friends": friend_username}}
     )
+    user_cache.invalidate(current_user.username)
+    friends_leaderboard_cache.invalidate(current_user.username)
     
     return {"message": f"{friend_username} retiré de vos amis"}
 
+@api_router.get("/user/friends/leaderboard")
+async def get_friends_leaderboard(
+    stat: str = Query(...),
+    current_user: UserView = Depends(get_current_user_fields("friends"))
+):
+    """Classement de l'utilisateur et de ses amis sur une stat (une agrégation, cache court)"""
+    stat = leaderboard_stat(stat)
+    cached = friends_leaderboard_cache.get(current_user.username, field=stat)
+    if cached is not None:
+        return {"stat": stat, "entries": cached}
+    
+    version = friends_leaderboard_cache.version(current_user.username)
+    players = await db.users.aggregate([
+        {"$match": {"username": {"$in": [current_user.username, *(current_user.friends or [])]}}},
+        {"$project": {
+            "_id": 0,
+            "username": 1,
+            "elo": f"$stats.{stat}.elo",
+            "level": f"$stats.{stat}.level"
+        }},
+        {"$sort": {"elo": -1, "username": 1}},
+    ]).to_list(None)
+    
+    entries = [
+        {**player, "rank": rank, "is_self": player["username"] == current_user.username}
+        for rank, player in enumerate(players, start=1)
+    ]
+    friends_leaderboard_cache.put(current_user.username, entries, version, field=stat)
+    return {"stat": stat, "entries": entries}
+
 # Club endpoints
 class ClubCreate(BaseModel):
     name: str
     description: str = ""
 
+class ClubStats(BaseModel):
+    """Statistiques pré-agrégées d'un club (collection club_stats)"""
+    member_count: int = 0
+    active_members: int = 0
+    total_level: int = 0
+    mean_elo: Dict[str, float] = Field(default_factory=dict)
+    refreshed_at: Optional[datetime] = None
+
 class Club(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     name: str
@@ -670,9 +3194,184 @@ class Club(BaseModel):
     members: List[str] = Field(default_factory=list)
     created_at: datetime = Field(default_factory=datetime.utcnow)
     max_members: int = 20
+    member_count: int = 0
+    stats: Optional[ClubStats] = None  # lu depuis club_stats, jamais stocké dans clubs
+
+# Statistiques de club matérialisées
+# club_stats est alimentée par une agrégation sur users (groupée par club_id) qui se
+# termine par $merge. Les clubs touchés par une écriture (adhésion, niveau, ELO,
+# connexion) sont marqués et recalculés par lots toutes les CLUB_STATS_REFRESH_SECONDS ;
+# un recalcul complet toutes les CLUB_STATS_FULL_REFRESH_SECONDS rattrape le reste
+# (écritures des autres workers, membres devenus inactifs).
+CLUB_STATS_REFRESH_SECONDS = int(os.environ.get('CLUB_STATS_REFRESH_SECONDS', 30))
+CLUB_STATS_FULL_REFRESH_SECONDS = int(os.environ.get('CLUB_STATS_FULL_REFRESH_SECONDS', 3600))
+CLUB_STATS_ACTIVE_DAYS = 7
+CLUB_STATS_BATCH = 1000
+CLUB_LEADERBOARD_PAGE_MAX = 100
+dirty_club_stats = set()
+
+def mark_club_stats_dirty(club_id: Optional[str]):
+    if club_id:
+        dirty_club_stats.add(club_id)
+
+def club_stats_pipeline(club_ids: Optional[List[str]], now: datetime) -> list:
+    """Agrégation des statistiques par club (sans l'étape $merge finale)"""
+    active_since = now - timedelta(days=CLUB_STATS_ACTIVE_DAYS)
+    match = {"club_id": {"$in": club_ids}} if club_ids is not None else {"club_id": {"$type": "string"}}
+    return [
+        {"$match": match},
+        {"$group": {
+            "_id": "$club_id",
+            "member_count": {"$sum": 1},
+            "active_members": {"$sum": {"$cond": [
+                {"$gte": [{"$max": ["$last_seen", "$last_login"]}, active_since]}, 1, 0
+            ]}},
+            "total_level": {"$sum": {"$add": [
+                {"$ifNull": [f"$stats.{stat_name}.level", 0]} for stat_name in STAT_NAMES
+            ]}},
+            **{f"elo_{stat_name}": {"$avg": f"$stats.{stat_name}.elo"} for stat_name in STAT_NAMES},
+        }},
+        {"$project": {
+            "member_count": 1,
+            "active_members": 1,
+            "total_level": 1,
+            "mean_elo": {stat_name: {"$round": [f"$elo_{stat_name}", 1]} for stat_name in STAT_NAMES},
+            "refreshed_at": {"$literal": now},
+        }},
+    ]
+
+async def refresh_club_stats(club_ids: Optional[List[str]] = None):
+    """Recalcule club_stats pour ces clubs (tous si None)"""
+    now = datetime.utcnow()
+    if club_ids is not None and not club_ids:
+        return
+    pipeline = club_stats_pipeline(club_ids, now)
+    pipeline.append({"$merge": {"into": "club_stats", "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}})
+    await db.users.aggregate(pipeline).to_list(None)
+    if club_ids is None:
+        # Clubs sans membre (non produits par l'agrégation)
+        await db.club_stats.delete_many({"refreshed_at": {"$lt": now}})
+
+async def run_club_stats_refresh():
+    last_full_refresh = None
+    while True:
+        try:
+            if last_full_refresh is None or time.monotonic() - last_full_refresh >= CLUB_STATS_FULL_REFRESH_SECONDS:
+                dirty_club_stats.clear()
+                await refresh_club_stats()
+                last_full_refresh = time.monotonic()
+            else:
+                club_ids = list(dirty_club_stats)
+                dirty_club_stats.clear()
+                for start in range(0, len(club_ids), CLUB_STATS_BATCH):
+                    await refresh_club_stats(club_ids[start:start + CLUB_STATS_BATCH])
+        except PyMongoError:
+            logger.exception("Rafraîchissement des statistiques de club impossible")
+        await asyncio.sleep(CLUB_STATS_REFRESH_SECONDS)
+
+async def load_club_stats(club_id: str) -> Optional[ClubStats]:
+    stats = await db.club_stats.find_one({"_id": club_id})
+    return ClubStats(**stats) if stats else None
+
+# Club search (préfixe sur name_lower + index texte name/description, classement et curseur)
+CLUB_SEARCH_PAGE_MAX = 50
+
+class ClubSearchResults(BaseModel):
+    results: List[Club]
+    next_cursor: Optional[str] = None
+
+def club_search_fields(name: str, members: List[str]) -> dict:
+    return {"name_lower": name.strip().lower(), "member_count": len(members)}
+
+def encode_cursor(values: list) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Curseur de pagination invalide")
+    if not isinstance(values, list) or len(values) != 3:
+        raise HTTPException(status_code=400, detail="Curseur de pagination invalide")
+    return values
+
+def text_search_terms(query: str) -> str:
+    """Neutralise la syntaxe de $text (phrases entre guillemets, négation par -)"""
+    return " ".join(term.lstrip("-") for term in query.replace('"', " ").split())
+
+async def search_clubs_ranked(query: str, sort: str, limit: int, after: Optional[str] = None):
+    """Recherche de clubs classée par pertinence (nom exact > préfixe > score texte)
+    ou par nombre de membres, avec pagination par curseur (rang, membres, id).
+    """
+    normalized = query.strip().lower()
+    terms = text_search_terms(query)
+    
+    pipeline = []
+    if normalized:
+        match_clauses = [{"name_lower": {"$gte": normalized, "$lt": normalized + PREFIX_UPPER_BOUND}}]
+        if terms:
+            match_clauses.append({"$text": {"$search": terms}})
+        pipeline.append({"$match": {"$or": match_clauses}})
+    
+    if sort == "relevance" and normalized:
+        is_prefix = {"$and": [
+            {"$gte": ["$name_lower", normalized]},
+            {"$lt": ["$name_lower", normalized + PREFIX_UPPER_BOUND]},
+        ]}
+        relevance = {"$add": [
+            {"$cond": [{"$eq": ["$name_lower", normalized]}, 100, 0]},
+            {"$cond": [is_prefix, 50, 0]},
+            {"$ifNull": [{"$meta": "textScore"}, 0]} if terms else 0,
+        ]}
+    else:
+        relevance = {"$literal": 0}
+    pipeline.append({"$addFields": {"relevance": relevance}})
+    
+    if after is not None:
+        last_relevance, last_members, last_id = decode_cursor(after)
+        pipeline.append({"$match": {"$or": [
+            {"relevance": {"$lt": last_relevance}},
+            {"relevance": last_relevance, "member_count": {"$lt": last_members}},
+            {"relevance": last_relevance, "member_count": last_members, "id": {"$gt": last_id}},
+        ]}})
+    
+    pipeline.extend([
+        {"$sort": {"relevance": -1, "member_count": -1, "id": 1}},
+        {"$limit": limit + 1},
+        {"$lookup": {"from": "club_stats", "localField": "id", "foreignField": "_id", "as": "stats"}},
+        {"$set": {"stats": {"$first": "$stats"}}},
+        {"$project": {"_id": 0, "stats._id": 0}},
+    ])
+    clubs = await db.clubs.aggregate(pipeline).to_list(limit + 1)
+    
+    next_cursor = None
+    if len(clubs) > limit:
+        clubs = clubs[:limit]
+        last = clubs[-1]
+        next_cursor = encode_cursor([last["relevance"], last["member_count"], last["id"]])
+    
+    return [Club(**club) for club in clubs], next_cursor
+
+async def backfill_club_search_fields():
+    """Ajoute name_lower / member_count aux clubs créés avant la recherche indexée"""
+    try:
+        cursor = db.clubs.find({"name_lower": {"$exists": False}}, {"_id": 1, "name": 1, "members": 1})
+        batch = []
+        async for club in cursor:
+            batch.append(UpdateOne(
+                {"_id": club["_id"]},
+                {"$set": club_search_fields(club["name"], club.get("members", []))}
+            ))
+            if len(batch) >= USER_SEARCH_BACKFILL_BATCH:
+                await db.clubs.bulk_write(batch, ordered=False)
+                batch = []
+        if batch:
+            await db.clubs.bulk_write(batch, ordered=False)
+    except PyMongoError:
+        logger.exception("Migration des champs de recherche des clubs interrompue")
 
 @api_router.post("/clubs/create")
-async def create_club(club_data: ClubCreate, current_user: User = Depends(get_current_user)):
+async def create_club(club_data: ClubCreate, current_user: UserView = Depends(get_current_user_fields("club_id"))):
     """Crée un nouveau club"""
     if current_user.club_id:
         raise HTTPException(status_code=400, detail="Vous êtes déjà membre d'un club")
@@ -686,28 +3385,49 @@ async def create_club(club_data: ClubCreate, current_user: User = Depends(get_cu
         name=club_data.name,
         description=club_data.description,
         owner=current_user.username,
-        members=[current_user.username]
+        members=[current_user.username],
+        member_count=1
     )
     
     # Créer le club
-    await db.clubs.insert_one(club.dict())
+    club_dict = club.dict(exclude={"stats"})
+    club_dict.update(club_search_fields(club.name, club.members))
+    try:
+        await db.clubs.insert_one(club_dict)
+    except DuplicateKeyError:
+        # Club du même nom créé entre la vérification et l'insertion (index name_unique)
+        raise HTTPException(status_code=400, detail="Ce nom de club existe déjà")
     
     # Mettre à jour l'utilisateur
     await db.users.update_one(
         {"username": current_user.username},
         {"$set": {"club_id": club.id}}
     )
+    user_cache.invalidate(current_user.username)
+    mark_club_stats_dirty(club.id)
     
     return {"message": f"Club '{club_data.name}' créé", "club": club}
 
+@api_router.get("/clubs/search", response_model=ClubSearchResults)
+async def search_clubs_paginated(
+    q: str = "",
+    sort: str = Query("relevance", pattern="^(relevance|members)$"),
+    limit: int = Query(20, ge=1, le=CLUB_SEARCH_PAGE_MAX),
+    after: Optional[str] = None,
+    current_user: UserView = Depends(get_current_user_fields())
+):
+    """Recherche de clubs classée et paginée ; sans q, liste les clubs par nombre de membres"""
+    results, next_cursor = await search_clubs_ranked(q, sort, limit, after)
+    return ClubSearchResults(results=results, next_cursor=next_cursor)
+
 @api_router.get("/clubs/search/{name}")
-async def search_clubs(name: str, current_user: User = Depends(get_current_user)):
-    """Recherche des clubs par nom"""
-    clubs = await db.clubs.find({"name": {"$regex": name, "$options": "i"}}).to_list(10)
-    return [Club(**club) for club in clubs]
+async def search_clubs(name: str, current_user: UserView = Depends(get_current_user_fields())):
+    """Recherche des clubs par nom (10 meilleurs résultats)"""
+    clubs, _ = await search_clubs_ranked(name, "relevance", 10)
+    return clubs
 
 @api_router.post("/clubs/join/{club_id}")
-async def join_club(club_id: str, current_user: User = Depends(get_current_user)):
+async def join_club(club_id: str, current_user: UserView = Depends(get_current_user_fields("club_id"))):
     """Rejoint un club"""
     if current_user.club_id:
         raise HTTPException(status_code=400, detail="Vous êtes déjà membre d'un club")
@@ -722,74 +3442,130 @@ async def join_club(club_id: str, current_user: User = Depends(get_current_user)
     # Ajouter le membre au club
     await db.clubs.update_one(
         {"id": club_id},
-        {"$push": {"members": current_user.username}}
+        {"$push": {"members": current_user.username}, "$inc": {"member_count": 1}}
     )
+    club_roster_cache.invalidate(club_id)
     
     # Mettre à jour l'utilisateur
     await db.users.update_one(
         {"username": current_user.username},
         {"$set": {"club_id": club_id}}
     )
+    user_cache.invalidate(current_user.username)
+    mark_club_stats_dirty(club_id)
     
     return {"message": f"Vous avez rejoint le club '{club['name']}'"}
 
 @api_router.get("/user/club")
-async def get_user_club(current_user: User = Depends(get_current_user)):
+async def get_user_club(current_user: UserView = Depends(get_current_user_fields("club_id"))):
     """Récupère les informations du club de l'utilisateur"""
     if not current_user.club_id:
         return {"message": "Vous n'êtes membre d'aucun club"}
     
+    roster = club_roster_cache.get(current_user.club_id)
+    if roster is not None:
+        return roster
+    
+    version = club_roster_cache.version(current_user.club_id)
     club = await db.clubs.find_one({"id": current_user.club_id})
     if not club:
         return {"message": "Club non trouvé"}
     
-    # Récupérer les infos des membres
-    members_data = []
-    for member_username in club["members"]:
-        member = await db.users.find_one({"username": member_username})
-        if member:
-            members_data.append(UserProfile(
-                id=member["id"],
-                username=member["username"],
-                stats=member["stats"],
-                is_online=member.get("is_online", False),
-                last_login=member.get("last_login")
-            ))
-    
-    return {
-        "club": Club(**club),
-        "members": members_data
+    # Récupérer les infos des membres en une seule requête (et les statistiques pré-agrégées en parallèle)
+    members, stats = await asyncio.gather(load_user_profiles(club["members"]), load_club_stats(club["id"]))
+    roster = {
+        "club": Club(**club, stats=stats),
+        "members": members
     }
+    club_roster_cache.put(current_user.club_id, roster, version)
+    return roster
 
 @api_router.post("/clubs/leave")
-async def leave_club(current_user: User = Depends(get_current_user)):
+async def leave_club(current_user: UserView = Depends(get_current_user_fields("club_id"))):
     """Quitte le club actuel"""
     if not current_user.club_id:
         raise HTTPException(status_code=400, detail="Vous n'êtes membre d'aucun club")
     
-    club = await db.clubs.find_one({"id": current_user.club_id})
-    if not club:
-        raise HTTPException(status_code=404, detail="Club non trouvé")
-    
-    # Retirer l'utilisateur du club
-    await db.clubs.update_one(
+    # Retirer l'utilisateur du club et relire la liste des membres en une seule opération
+    updated_club = await db.clubs.find_one_and_update(
         {"id": current_user.club_id},
-        {"$pull": {"members": current_user.username}}
+        {"$pull": {"members": current_user.username}, "$inc": {"member_count": -1}},
+        projection={"_id": 0, "members": 1},
+        return_document=ReturnDocument.AFTER
     )
+    if not updated_club:
+        raise HTTPException(status_code=404, detail="Club non trouvé")
     
     # Supprimer le club s'il n'y a plus de membres
-    updated_club = await db.clubs.find_one({"id": current_user.club_id})
     if not updated_club["members"]:
         await db.clubs.delete_one({"id": current_user.club_id})
+        await db.club_stats.delete_one({"_id": current_user.club_id})
+    club_roster_cache.invalidate(current_user.club_id)
     
     # Mettre à jour l'utilisateur
     await db.users.update_one(
         {"username": current_user.username},
         {"$unset": {"club_id": ""}}
     )
+    user_cache.invalidate(current_user.username)
+    if updated_club["members"]:
+        mark_club_stats_dirty(current_user.club_id)
     
     return {"message": "Vous avez quitté le club"}
 
+@api_router.get("/clubs/leaderboard")
+async def get_clubs_leaderboard(
+    by: str = Query("total_level", pattern="^(total_level|active_members|member_count|mean_elo)$"),
+    stat: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=CLUB_LEADERBOARD_PAGE_MAX),
+    current_user: UserView = Depends(get_current_user_fields())
+):
+    """Classement des clubs à partir de club_stats (by=mean_elo nécessite stat)"""
+    if by == "mean_elo":
+        sort_field = f"mean_elo.{leaderboard_stat(stat)}"
+    else:
+        sort_field = by
+    
+    clubs = await db.club_stats.aggregate([
+        {"$sort": {sort_field: -1, "_id": 1}},
+        {"$limit": limit},
+        {"$lookup": {"from": "clubs", "localField": "_id", "foreignField": "id", "as": "club"}},
+    ]).to_list(limit)
+    
+    return [
+        {
+            "rank": rank,
+            "club_id": club["_id"],
+            "name": club["club"][0]["name"] if club["club"] else None,
+            "stats": ClubStats(**club)
+        }
+        for rank, club in enumerate(clubs, start=1)
+    ]
+
+@api_router.get("/cache/stats")
+async def get_cache_stats():
+    """Compteurs des caches en mémoire (hits/misses) de ce processus"""
+    return {
+        "users": user_cache.stats(),
+        "club_rosters": club_roster_cache.stats(),
+        "friends_leaderboards": friends_leaderboard_cache.stats(),
+        "attack_events": attack_event_hub.stats(),
+        "presence": presence_tracker.stats()
+    }
+
+@api_router.get("/metrics")
+async def get_metrics():
+    """Métriques HTTP et MongoDB par route de ce processus, au format texte Prometheus"""
+    return Response(
+        content=request_metrics.render() + mongo_command_metrics.render(),
+        media_type="text/plain; version=0.0.4"
+    )
+
+@api_router.get("/auth/hashing/stats")
+async def get_password_hashing_stats():
+    """Métriques du pool de hachage bcrypt (file d'attente, concurrence, temps d'attente)"""
+    return password_hasher.stats()
+
 # Add your routes to the router instead of directly to app
 @api_router.get("/")
 async def root():
@@ -816,15 +3592,15 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
+# Ajouté en dernier : englobe tout le reste, CORS compris
+app.add_middleware(RequestMetricsMiddleware, metrics=request_metrics)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Vérifie l'utilisation des index MongoDB par les routes de server.py
+
+Crée les index déclarés (MONGO_INDEXES), puis exécute explain() sur chaque forme
+de requête listée dans MONGO_QUERY_SHAPES. Le script échoue (code 1) si l'une
+d'elles retombe sur un COLLSCAN.
+
+Usage : python verify_indexes.py
+"""
+
+import asyncio
+import sys
+
+from pymongo import timeout as mongo_timeout
+
+from server import MONGO_QUERY_SHAPES, client, db, ensure_indexes
+
+
+def plan_stages(plan):
+    """Liste toutes les étapes d'un plan d'exécution (moteurs classique et SBE)"""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(plan_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(plan_stages(item))
+    return stages
+
+
+async def verify():
+    # Construction des index : sans budget par opération, comme au démarrage du serveur
+    with mongo_timeout(0):
+        await ensure_indexes()
+
+    failures = 0
+    for collection_name, query_filter, sort in MONGO_QUERY_SHAPES:
+        cursor = db[collection_name].find(query_filter)
+        if sort:
+            cursor = cursor.sort(sort)
+        explain = await cursor.explain()
+        stages = plan_stages(explain["queryPlanner"]["winningPlan"])
+
+        if "COLLSCAN" in stages:
+            failures += 1
+            print(f"❌ {collection_name} {query_filter}: COLLSCAN ({' > '.join(stages)})")
+        else:
+            print(f"✅ {collection_name} {query_filter}: {' > '.join(stages)}")
+
+    print(f"\n{len(MONGO_QUERY_SHAPES) - failures}/{len(MONGO_QUERY_SHAPES)} query shapes use an index")
+    return failures == 0
+
+
+if __name__ == "__main__":
+    try:
+        success = asyncio.run(verify())
+    finally:
+        client.close()
+    sys.exit(0 if success else 1)
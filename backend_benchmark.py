@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+"""
+Backend micro-benchmarks for Le Lapin Blanc
+Measures per-request cost of the hot paths in backend/server.py
+(database benchmarks use MONGO_URL and are skipped when Mongo is unreachable)
+"""
+
+import asyncio
+import os
+import random
+import statistics
+import string
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import requests
+
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+
+import server  # noqa: E402
+
+
+def timed(fn, repeat=5):
+    """Return the best wall time (ms) over several runs"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def make_inventory(size):
+    return [server.UserAttack(attack_id=random.choice(server.ATTACK_IDS)) for _ in range(size)]
+
+
+def make_pending(size):
+    return [
+        {"attacker": "bench", "attack_id": random.choice(server.ATTACK_IDS), "target_stat": "travail"}
+        for _ in range(size)
+    ]
+
+
+def bench_catalog_lookups(sizes=(100, 1000, 10000)):
+    """GET /user/attacks handler: legacy linear catalog scan per card vs current handler"""
+    print("\n🔍 Benchmarking GET /user/attacks handler...")
+
+    def legacy(inventory):
+        # Body of the original get_user_attacks (one ATTACKS_DATA scan per card)
+        available_attacks = []
+        for user_attack in inventory:
+            if not user_attack.used:
+                attack_data = next((a for a in server.ATTACKS_DATA if a["id"] == user_attack.attack_id), None)
+                if attack_data:
+                    available_attacks.append({**attack_data, "obtained_at": user_attack.obtained_at})
+        return available_attacks
+
+    loop = asyncio.new_event_loop()
+    for size in sizes:
+        inventory = make_inventory(size)
+        counts = {}
+        for card in inventory:
+            counts[str(card.attack_id)] = counts.get(str(card.attack_id), 0) + 1
+        user = server.UserView(username="bench", attack_inventory=counts, attack_history=[])
+        before = timed(lambda: legacy(inventory))
+        after = timed(lambda: loop.run_until_complete(server.get_user_attacks(current_user=user)))
+        print(f"  {size:>6} cards: legacy {before:8.3f} ms | handler {after:8.3f} ms | x{before / after:5.1f}")
+    loop.close()
+
+
+def bench_title_lookups(iterations=10000):
+    """GET /user/titles handler: legacy per-title comparison vs bisect on thresholds"""
+    print("\n🔍 Benchmarking GET /user/titles handler...")
+    users = [
+        server.UserView(
+            username="bench",
+            stats={stat: {"level": random.randint(0, 30)} for stat in server.STAT_NAMES},
+            current_title="Novice",
+        )
+        for _ in range(iterations)
+    ]
+
+    def legacy(user):
+        # Body of the original get_user_titles
+        total_level = sum(stat["level"] for stat in user.stats.values())
+        titles = []
+        for title in server.TITLES_DATA:
+            unlocked = total_level >= title["level_required"]
+            titles.append({**title, "unlocked": unlocked, "current": unlocked and title["name"] == user.current_title})
+        return {"total_level": total_level, "current_title": user.current_title, "titles": titles}
+
+    loop = asyncio.new_event_loop()
+
+    async def handler_all():
+        for user in users:
+            await server.get_user_titles(current_user=user)
+
+    before = timed(lambda: [legacy(user) for user in users])
+    after = timed(lambda: loop.run_until_complete(handler_all()))
+    loop.close()
+    print(f"  {iterations} requests: legacy {before:8.3f} ms | handler {after:8.3f} ms | x{before / after:5.1f}")
+
+
+def bench_effect_engine(sizes=(100, 500, 1000)):
+    """Pending attacks: per-attack if/elif chain + deepcopy vs registered handlers folded into one delta"""
+    print("\n🔍 Benchmarking effect engine (apply-pending-attacks)...")
+    import copy
+
+    user = {
+        "stats": {stat: {"level": 1, "elo": 1000} for stat in server.STAT_NAMES},
+        "health": 100,
+        "energy": 100,
+    }
+
+    def legacy(pending):
+        stats = copy.deepcopy(user["stats"])
+        health, energy = user["health"], user["energy"]
+        for attack in pending:
+            attack_data = next((a for a in server.ATTACKS_DATA if a["id"] == attack["attack_id"]), None)
+            effect_type, value = attack_data["effect_type"], attack_data["effect_value"]
+            stat = attack.get("target_stat")
+            if effect_type == "elo_loss":
+                for stat_name in ([stat] if stat in stats else stats):
+                    stats[stat_name]["elo"] = max(0, stats[stat_name]["elo"] - value)
+            elif effect_type == "elo_steal" and stat in stats:
+                stats[stat]["elo"] -= min(value, stats[stat]["elo"])
+            elif effect_type == "health_loss":
+                health = max(0, health - value)
+            elif effect_type == "health_percentage":
+                health = max(0, health - health * value // 100)
+            elif effect_type in ("energy_drain", "energy_steal"):
+                energy = max(0, energy - value)
+            elif effect_type == "energy_reset":
+                energy = 0
+        return stats, health, energy
+
+    def engine(pending):
+        delta, _ = server.fold_attacks(pending)
+        return delta.to_update()
+
+    for size in sizes:
+        pending = make_pending(size)
+        before = timed(lambda: legacy(pending))
+        after = timed(lambda: engine(pending))
+        print(f"  {size:>6} attacks: legacy {before:8.3f} ms | engine {after:8.3f} ms | {size / after * 1000:10.0f} attacks/s")
+
+
+def bench_inventory_format(sizes=(100, 1000, 10000)):
+    """User document: legacy `attacks` list vs counted attack_inventory + history ring"""
+    print("\n🔍 Benchmarking attack inventory format (document size / get_current_user parse)...")
+    import bson
+
+    base = server.User(username="bench", email="bench@example.com").dict()
+    for size in sizes:
+        attacks = [
+            {**server.UserAttack(attack_id=random.choice(server.ATTACK_IDS)).dict(), "used": i % 2 == 0}
+            for i in range(size)
+        ]
+        legacy_doc = {**base, "attacks": attacks}
+        counted_doc = {**base}
+        migration = server.attack_inventory_migration(attacks)
+        counted_doc["attack_inventory"] = {
+            path.split(".", 1)[1]: count for path, count in migration["$inc"].items()
+        }
+        counted_doc["attack_history"] = migration["$push"]["attack_history"]["$each"]
+
+        def legacy():
+            # the previous User model validated every card as a UserAttack
+            server.User(**legacy_doc)
+            [server.UserAttack(**attack) for attack in attacks]
+
+        def counted():
+            server.User(**counted_doc)
+
+        before, after = timed(legacy), timed(counted)
+        print(
+            f"  {size:>6} cards: legacy {len(bson.encode(legacy_doc)):>8} B {before:8.3f} ms"
+            f" | counted {len(bson.encode(counted_doc)):>6} B {after:8.3f} ms"
+        )
+
+
+def bench_leaderboard(total_users=None, queries=1000):
+    """ELO leaderboard: sort per request vs incrementally maintained sorted index"""
+    total_users = total_users or int(os.environ.get("BENCH_LEADERBOARD_USERS", 200_000))
+    print(f"\n🔍 Benchmarking ELO leaderboard on {total_users} users...")
+    elos = {
+        f"player{i}": tuple(random.randint(800, 1600) for _ in server.STAT_NAMES)
+        for i in range(total_users)
+    }
+    leaderboard = server.EloLeaderboard(server.STAT_NAMES)
+    start = time.perf_counter()
+    leaderboard.finish_refresh(dict(elos), leaderboard.build(elos))
+    print(f"  build (5 stats)    {(time.perf_counter() - start) * 1000:10.1f} ms")
+
+    usernames = random.sample(list(elos), queries)
+
+    def sort_per_request():
+        ranked = sorted(elos, key=lambda username: (-elos[username][1], username))
+        return ranked[:20], ranked.index(usernames[0]) + 1
+
+    def per_query(fn):
+        start = time.perf_counter()
+        for username in usernames:
+            fn(username)
+        return (time.perf_counter() - start) / queries * 1000
+
+    naive = timed(sort_per_request, repeat=1)
+    top = per_query(lambda username: leaderboard.top("sport", 0, 20))
+    rank = per_query(lambda username: leaderboard.rank("sport", username))
+    update = per_query(lambda username: leaderboard.update(username, tuple(e + 1 for e in leaderboard.elos[username])))
+    print(f"  sort per request   {naive:10.3f} ms")
+    print(f"  top-20 {top:8.4f} ms | rank {rank:8.4f} ms | update (5 stats) {update:8.4f} ms")
+
+    # Resolver chunk: on-loop cost of deferring 1000 writes (the rebuild runs in a thread)
+    chunk = {username: tuple(e - 5 for e in leaderboard.elos[username]) for username in usernames}
+    deferred = timed(lambda: [leaderboard.defer(username, elo) for username, elo in chunk.items()], repeat=1)
+    start = time.perf_counter()
+    snapshot = {**leaderboard.elos, **leaderboard.pending}
+    leaderboard.finish_refresh(snapshot, leaderboard.build(snapshot))
+    rebuild = (time.perf_counter() - start) * 1000
+    print(f"  {queries}-user chunk: on loop {deferred:8.3f} ms | off-loop rebuild {rebuild:10.1f} ms")
+
+
+def bench_attack_event_hub(subscribers=10_000, events=100_000):
+    """In-process SSE hub: publish cost and slow-client overflow (no socket I/O)"""
+    print(f"\n🔍 Benchmarking attack event hub ({subscribers} open streams)...")
+
+    async def run():
+        hub = server.AttackEventHub(server.ATTACK_EVENTS_QUEUE_SIZE)
+        usernames = [f"player{i}" for i in range(subscribers)]
+        queues = [hub.subscribe(username) for username in usernames]
+        event = {"event": "attack", "id": "0", "data": {}}
+        targets = [random.choice(usernames) for _ in range(events)]
+
+        start = time.perf_counter()
+        for target in targets:
+            hub.publish(target, event)
+        elapsed = time.perf_counter() - start
+        print(f"  publish            {elapsed / events * 1e6:10.2f} µs/event")
+
+        # One client never reads: its queue is bounded and collapses into a resync
+        for _ in range(server.ATTACK_EVENTS_QUEUE_SIZE * 10):
+            hub.publish(usernames[0], event)
+        print(f"  slow client queue  {queues[0].qsize():10d} events | {hub.stats()['dropped']} dropped")
+
+    asyncio.run(run())
+
+
+def bench_request_metrics(requests_count=200_000, routes=40):
+    """Per-request cost of the metrics middleware bookkeeping, and /api/metrics render time"""
+    print(f"\n🔍 Benchmarking request metrics ({routes} routes)...")
+    metrics = server.RequestMetrics()
+    samples = [
+        (f"/api/route{random.randrange(routes)}", random.choice((200, 200, 200, 400, 404)),
+         random.expovariate(50), random.randint(50, 50_000))
+        for _ in range(requests_count)
+    ]
+    start = time.perf_counter()
+    for route, status_code, duration, size in samples:
+        metrics.record("GET", route, status_code, duration, size)
+    elapsed = time.perf_counter() - start
+    render = timed(metrics.render)
+    print(f"  record             {elapsed / requests_count * 1e6:10.2f} µs/request")
+    print(f"  render             {render:10.3f} ms ({len(metrics.render())} bytes)")
+
+
+def get_bench_db(suffix=""):
+    """Dedicated benchmark database on MONGO_URL, or None if Mongo is unreachable.
+
+    Benchmarks that drop or reshape collections pass a suffix so they never
+    touch the data another benchmark seeded.
+    """
+    mongo_client = MongoClient(os.environ["MONGO_URL"], serverSelectionTimeoutMS=2000)
+    try:
+        mongo_client.admin.command("ping")
+    except PyMongoError as e:
+        print(f"⚠️  MongoDB not reachable, skipping database benchmarks: {e}")
+        return None
+    return mongo_client[os.environ.get("BENCH_DB_NAME", "lapin_blanc_bench") + suffix]
+
+
+def percentile_ms(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] * 1000
+
+
+def seed_users(bench_db, total):
+    """Insert synthetic users until the users collection holds `total` documents"""
+    existing = bench_db.users.estimated_document_count()
+    if existing >= total:
+        return
+    print(f"  Seeding {total - existing} users...")
+    batch = []
+    for i in range(existing, total):
+        username = "".join(random.choices(string.ascii_lowercase, k=random.randint(4, 10))) + str(i)
+        batch.append({
+            "id": str(i),
+            "username": username,
+            "email": f"{username}@example.com",
+            "stats": {},
+            "is_online": False,
+            **server.user_search_fields(username),
+        })
+        if len(batch) == 10000:
+            bench_db.users.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        bench_db.users.insert_many(batch, ordered=False)
+
+
+def bench_user_search(total_users=None, queries=200):
+    """User search: unanchored case-insensitive regex vs indexed prefix / trigram search"""
+    total_users = total_users or int(os.environ.get("BENCH_USERS", 1_000_000))
+    print(f"\n🔍 Benchmarking user search on {total_users} users...")
+    bench_db = get_bench_db()
+    if bench_db is None:
+        return
+
+    seed_users(bench_db, total_users)
+    bench_db.users.create_indexes(server.MONGO_INDEXES["users"])
+    terms = ["".join(random.choices(string.ascii_lowercase, k=3)) for _ in range(queries)]
+
+    def legacy(term):
+        bench_db.users.find_one({"username": {"$regex": term, "$options": "i"}})
+
+    def prefix(term):
+        list(bench_db.users.find(
+            {"username_lower": {"$gte": term, "$lt": term + server.PREFIX_UPPER_BOUND}},
+            server.USER_PROFILE_PROJECTION
+        ).sort([("username_lower", 1), ("username", 1)]).limit(20))
+
+    def fuzzy(term):
+        grams = server.username_trigrams(term)
+        list(bench_db.users.aggregate([
+            {"$match": {"username_trigrams": {"$in": grams}}},
+            {"$project": {"username": 1, "score": {"$size": {"$setIntersection": ["$username_trigrams", {"$literal": grams}]}}}},
+            {"$sort": {"score": -1}},
+            {"$limit": 20},
+        ]))
+
+    for label, fn in (("regex (legacy)", legacy), ("prefix (indexed)", prefix), ("trigram (fuzzy)", fuzzy)):
+        samples = []
+        for term in terms:
+            start = time.perf_counter()
+            fn(term)
+            samples.append(time.perf_counter() - start)
+        print(f"  {label:<17} p50 {percentile_ms(samples, 50):8.2f} ms | p99 {percentile_ms(samples, 99):8.2f} ms | mean {statistics.mean(samples) * 1000:8.2f} ms")
+
+
+def bench_attack_resolver(total_users=None, attacks_per_user=3):
+    """Midnight resolver: settle a day's pending attacks for every user"""
+    total_users = total_users or int(os.environ.get("BENCH_RESOLVER_USERS", 100_000))
+    print(f"\n🔍 Benchmarking midnight resolver on {total_users} targeted users...")
+    bench_db = get_bench_db("_resolver")
+    if bench_db is None:
+        return
+
+    bench_db.users.drop()
+    bench_db.attack_actions.drop()
+    bench_db.job_checkpoints.drop()
+    stats = {stat: {"level": 1, "xp": 0, "maxXp": 100, "elo": 1200} for stat in server.STAT_NAMES}
+    bench_db.users.insert_many(
+        [{"username": f"target{i}", "stats": stats, "health": 100, "energy": 100} for i in range(total_users)],
+        ordered=False,
+    )
+    bench_db.users.create_indexes(server.MONGO_INDEXES["users"][:1])
+    bench_db.attack_actions.create_indexes(server.MONGO_INDEXES["attack_actions"])
+    for start in range(0, total_users, 10000):
+        bench_db.attack_actions.insert_many([
+            {
+                "attacker": "bench",
+                "target": f"target{i}",
+                "attack_id": random.choice(server.ATTACK_IDS),
+                "target_stat": random.choice(server.STAT_NAMES),
+                "created_at": datetime.utcnow(),
+                "applied": False,
+            }
+            for i in range(start, min(start + 10000, total_users))
+            for _ in range(attacks_per_user)
+        ], ordered=False)
+    time.sleep(1)  # the run cutoff excludes attacks created during the current second
+
+    server.db = server.client[bench_db.name]
+    start = time.perf_counter()
+    with server.mongo_timeout(0):  # full pass, no per-operation budget (as in the lifespan)
+        asyncio.run(server.resolve_pending_attacks())
+    elapsed = time.perf_counter() - start
+    remaining = bench_db.attack_actions.count_documents({"applied": False})
+    print(f"  {total_users * attacks_per_user} attacks / {total_users} users settled in {elapsed:8.2f} s | {total_users / elapsed:8.0f} users/s | {remaining} left")
+
+
+def bench_login_storm(base_url=None, storm_threads=32, duration_s=10):
+    """Latency of an unrelated endpoint (GET /api/) while a login storm runs"""
+    base_url = base_url or os.environ.get("BENCH_BACKEND_URL", "http://localhost:8000")
+    print(f"\n🔍 Benchmarking GET /api/ latency during a login storm on {base_url}...")
+    try:
+        requests.get(f"{base_url}/api/", timeout=5)
+    except requests.exceptions.RequestException as e:
+        print(f"⚠️  Backend not reachable, skipping login storm benchmark: {e}")
+        return
+
+    username = f"storm_{uuid.uuid4().hex[:8]}"
+    credentials = {"username": username, "password": "white_rabbit_storm"}
+    requests.post(
+        f"{base_url}/api/auth/register",
+        json={**credentials, "email": f"{username}@example.com"},
+        timeout=30,
+    )
+
+    def probe(stop):
+        samples = []
+        while not stop.is_set():
+            start = time.perf_counter()
+            requests.get(f"{base_url}/api/", timeout=30)
+            samples.append(time.perf_counter() - start)
+            time.sleep(0.01)
+        return samples
+
+    def storm(stop):
+        logins = 0
+        with requests.Session() as session:
+            while not stop.is_set():
+                session.post(f"{base_url}/api/auth/login", json=credentials, timeout=60)
+                logins += 1
+        return logins
+
+    for label, threads in (("idle", 0), (f"{storm_threads} login threads", storm_threads)):
+        stop = threading.Event()
+        with ThreadPoolExecutor(max_workers=threads + 1) as pool:
+            probe_future = pool.submit(probe, stop)
+            storm_futures = [pool.submit(storm, stop) for _ in range(threads)]
+            time.sleep(duration_s)
+            stop.set()
+            samples = probe_future.result()
+            logins = sum(future.result() for future in storm_futures)
+        print(f"  {label:<18} GET /api/ p50 {percentile_ms(samples, 50):8.2f} ms | p99 {percentile_ms(samples, 99):8.2f} ms | {logins / duration_s:6.1f} logins/s")
+
+
+def run_all_benchmarks():
+    random.seed(int(os.environ.get("BENCH_SEED", 42)))
+    print("=" * 60)
+    print("⏱️  LE LAPIN BLANC BACKEND BENCHMARKS")
+    print("=" * 60)
+
+    bench_catalog_lookups()
+    bench_title_lookups()
+    bench_effect_engine()
+    bench_inventory_format()
+    bench_leaderboard()
+    bench_attack_event_hub()
+    bench_request_metrics()
+    bench_user_search()
+    bench_attack_resolver()
+    bench_login_storm()
+
+
+if __name__ == "__main__":
+    run_all_benchmarks()
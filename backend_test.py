@@ -335,6 +335,64 @@ def test_user_search(base_url, token, username):
         print(f"❌ User search connection error: {e}")
         return False
 
+def test_user_search_ranked(base_url, token, username):
+    """Test GET /api/users/search?q= ranked prefix search"""
+    print(f"\n🔍 Testing ranked user search /api/users/search?q={username.upper()}...")
+    try:
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        response = requests.get(
+            f"{base_url}/api/users/search",
+            params={"q": username.upper(), "limit": 10},
+            headers=headers,
+            timeout=10
+        )
+        
+        print(f"Status Code: {response.status_code}")
+        
+        if response.status_code == 200:
+            data = response.json()
+            usernames = [user["username"] for user in data.get("results", [])]
+            if usernames and usernames[0] == username and "next_cursor" in data:
+                print(f"✅ Ranked search ranks {username} first among {len(usernames)} results (case-insensitive)")
+                return True
+            else:
+                print("❌ Ranked search did not return the created user")
+                return False
+        else:
+            print(f"❌ Ranked search failed with status {response.status_code}")
+            print(f"Response: {response.text}")
+            return False
+            
+    except requests.exceptions.RequestException as e:
+        print(f"❌ Ranked search connection error: {e}")
+        return False
+
+def test_presence_heartbeat(base_url, token):
+    """Test POST /api/user/heartbeat and the in-memory online status"""
+    print("\n🔍 Testing presence heartbeat /api/user/heartbeat...")
+    try:
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        response = requests.post(f"{base_url}/api/user/heartbeat", headers=headers, timeout=10)
+        print(f"Status Code: {response.status_code}")
+        
+        if response.status_code != 200 or "online_until" not in response.json():
+            print(f"❌ Heartbeat failed: {response.text}")
+            return False
+        
+        response = requests.get(f"{base_url}/api/auth/me", headers=headers, timeout=10)
+        if response.status_code == 200 and response.json().get("is_online") is True:
+            print("✅ Heartbeat marks the user online")
+            return True
+        else:
+            print(f"❌ User not online after heartbeat: {response.text}")
+            return False
+            
+    except requests.exceptions.RequestException as e:
+        print(f"❌ Heartbeat connection error: {e}")
+        return False
+
 def test_user_logout(base_url, token):
     """Test POST /api/auth/logout endpoint"""
     print("\n🔍 Testing user logout /api/auth/logout...")
@@ -357,7 +415,7 @@ def test_user_logout(base_url, token):
             print(f"Response: {data}")
             
             if "message" in data:
-                print("✅ User logout successful - is_online status should be updated to false")
+                print("✅ User logout successful - user is marked offline")
                 return True
             else:
                 print("❌ Logout response missing message")
@@ -456,6 +514,59 @@ def test_titles_endpoint(base_url):
         print(f"❌ Titles endpoint connection error: {e}")
         return False
 
+def test_metrics_endpoint(base_url):
+    """Test GET /api/metrics (Prometheus text format, per-route and Mongo command histograms)"""
+    print("\n🔍 Testing metrics endpoint /api/metrics...")
+    try:
+        requests.get(f"{base_url}/api/attacks", timeout=10)
+        response = requests.get(f"{base_url}/api/metrics", timeout=10)
+        print(f"Status Code: {response.status_code}")
+        
+        if response.status_code != 200 or not response.headers.get("content-type", "").startswith("text/plain"):
+            print(f"❌ Metrics endpoint failed: {response.status_code} - {response.text[:200]}")
+            return False
+        
+        expected = [
+            'http_requests_total{method="GET",route="/api/attacks",status="200"}',
+            'http_request_duration_seconds_bucket{method="GET",route="/api/attacks",le="+Inf"}',
+            'http_request_duration_quantile_seconds{method="GET",route="/api/attacks",quantile="0.99"}',
+            "http_requests_in_flight",
+            'mongo_commands_per_request_bucket{route="/api/attacks",le="+Inf"}',
+            "mongo_pool_checked_out",
+        ]
+        missing = [line for line in expected if line not in response.text]
+        if missing:
+            print(f"❌ Missing metrics: {missing}")
+            return False
+        
+        print("✅ Per-route metrics exposed in Prometheus format")
+        return True
+            
+    except requests.exceptions.RequestException as e:
+        print(f"❌ Metrics connection error: {e}")
+        return False
+
+def test_catalog_caching(base_url):
+    """Test ETag / 304 handling on the static catalog endpoints"""
+    print("\n🔍 Testing catalog caching (ETag, Cache-Control, 304)...")
+    try:
+        for path in ["/api/attacks", "/api/defenses", "/api/titles", "/api/special-titles"]:
+            response = requests.get(f"{base_url}{path}", timeout=10)
+            etag = response.headers.get("ETag")
+            if response.status_code != 200 or not etag or "Cache-Control" not in response.headers:
+                print(f"❌ {path} missing ETag/Cache-Control (status {response.status_code})")
+                return False
+            
+            revalidation = requests.get(f"{base_url}{path}", headers={"If-None-Match": etag}, timeout=10)
+            if revalidation.status_code != 304 or revalidation.content:
+                print(f"❌ {path} did not answer 304 to If-None-Match (status {revalidation.status_code})")
+                return False
+            print(f"✅ {path}: ETag {etag} revalidated with 304")
+        return True
+    except requests.exceptions.RequestException as e:
+        print(f"❌ Catalog caching connection error: {e}")
+        return False
+
 def test_user_attacks(base_url, token):
     """Test GET /api/user/attacks endpoint"""
     print("\n🔍 Testing user attacks /api/user/attacks...")
@@ -705,6 +816,263 @@ def test_attack_system_flow(base_url, token1, token2, attack_id, username1, user
         print(f"❌ Attack system flow connection error: {e}")
         return False
 
+def test_pending_attacks_pagination(base_url, token):
+    """Test GET /api/user/pending-attacks pagination (limit/after + X-Next-Cursor)"""
+    print("\n🔍 Testing pending attacks pagination...")
+    try:
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        response = requests.get(
+            f"{base_url}/api/user/pending-attacks",
+            params={"limit": 1},
+            headers=headers,
+            timeout=10
+        )
+        
+        print(f"Status Code: {response.status_code}")
+        
+        if response.status_code != 200 or len(response.json()) > 1:
+            print(f"❌ Paginated pending attacks failed: {response.status_code} - {response.text}")
+            return False
+        
+        next_cursor = response.headers.get("X-Next-Cursor")
+        if next_cursor:
+            response = requests.get(
+                f"{base_url}/api/user/pending-attacks",
+                params={"limit": 1, "after": next_cursor},
+                headers=headers,
+                timeout=10
+            )
+            if response.status_code != 200:
+                print(f"❌ Next page failed with status {response.status_code}")
+                return False
+        
+        response = requests.get(
+            f"{base_url}/api/user/pending-attacks",
+            params={"after": "not-a-cursor"},
+            headers=headers,
+            timeout=10
+        )
+        if response.status_code == 400:
+            print("✅ Pending attacks are paginated and invalid cursors are rejected")
+            return True
+        else:
+            print(f"❌ Invalid cursor returned {response.status_code} instead of 400")
+            return False
+            
+    except requests.exceptions.RequestException as e:
+        print(f"❌ Pending attacks pagination connection error: {e}")
+        return False
+
+def test_attack_events_stream(base_url, token):
+    """Test GET /api/user/attack-events (SSE, opened with a ?ticket= from /api/user/attack-events/ticket)"""
+    print("\n🔍 Testing attack events stream...")
+    try:
+        response = requests.get(f"{base_url}/api/user/attack-events", timeout=10)
+        if response.status_code != 401:
+            print(f"❌ Stream without ticket should be rejected, got {response.status_code}")
+            return False
+        
+        # Le jeton de session ne doit pas être accepté dans l'URL
+        response = requests.get(f"{base_url}/api/user/attack-events", params={"ticket": token}, timeout=10)
+        if response.status_code != 401:
+            print(f"❌ Session token passed as ticket should be rejected, got {response.status_code}")
+            return False
+        
+        response = requests.post(
+            f"{base_url}/api/user/attack-events/ticket",
+            headers={"Authorization": f"Bearer {token}"},
+            timeout=10
+        )
+        if response.status_code != 200:
+            print(f"❌ Ticket request failed: {response.status_code} - {response.text}")
+            return False
+        ticket = response.json()["ticket"]
+        
+        # Le ticket n'ouvre que le flux
+        response = requests.get(f"{base_url}/api/user/attacks", headers={"Authorization": f"Bearer {ticket}"}, timeout=10)
+        if response.status_code != 401:
+            print(f"❌ Stream ticket should not authenticate other routes, got {response.status_code}")
+            return False
+        
+        with requests.get(
+            f"{base_url}/api/user/attack-events",
+            params={"ticket": ticket},
+            stream=True,
+            timeout=10
+        ) as response:
+            print(f"Status Code: {response.status_code}")
+            content_type = response.headers.get("content-type", "")
+            first_line = next(response.iter_lines(decode_unicode=True), "")
+        
+        if response.status_code != 200 or not content_type.startswith("text/event-stream") or not first_line.startswith("retry:"):
+            print(f"❌ Unexpected stream response: {content_type} - {first_line}")
+            return False
+        
+        # Reconnexion avec un Last-Event-ID illisible : le serveur demande une resynchronisation
+        with requests.get(
+            f"{base_url}/api/user/attack-events",
+            params={"ticket": ticket},
+            headers={"Last-Event-ID": "not-an-id"},
+            stream=True,
+            timeout=10
+        ) as response:
+            replay_event = next((line for line in response.iter_lines(decode_unicode=True) if line.startswith("event:")), "")
+        
+        if replay_event == "event: resync":
+            print("✅ Attack events stream opened with a stream ticket and handles Last-Event-ID")
+            return True
+        else:
+            print(f"❌ Expected a resync event on reconnect, got: {replay_event}")
+            return False
+            
+    except requests.exceptions.RequestException as e:
+        print(f"❌ Attack events stream connection error: {e}")
+        return False
+
+def test_active_effects(base_url, token):
+    """Test GET /api/user/effects (active timed effects and effective modifiers)"""
+    print("\n🔍 Testing active effects /api/user/effects...")
+    try:
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        response = requests.get(f"{base_url}/api/user/effects", headers=headers, timeout=10)
+        
+        print(f"Status Code: {response.status_code}")
+        
+        if response.status_code == 200:
+            data = response.json()
+            if isinstance(data.get("effects"), list) and isinstance(data.get("modifiers"), dict):
+                print(f"✅ Active effects returned ({len(data['effects'])} effects, {len(data['modifiers'])} modifiers)")
+                return True
+            else:
+                print(f"❌ Unexpected active effects payload: {data}")
+                return False
+        else:
+            print(f"❌ Active effects failed with status {response.status_code}")
+            print(f"Response: {response.text}")
+            return False
+            
+    except requests.exceptions.RequestException as e:
+        print(f"❌ Active effects connection error: {e}")
+        return False
+
+def test_parallel_card_consumption(base_url, token, target_username):
+    """Test that parallel POST /api/user/attack calls never spend more cards than owned"""
+    print("\n🔍 Testing parallel card consumption...")
+    try:
+        from concurrent.futures import ThreadPoolExecutor
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        response = requests.post(f"{base_url}/api/user/level-up?stat_name=sport", headers=headers, timeout=10)
+        if response.status_code != 200:
+            print(f"❌ Level up failed with status {response.status_code}")
+            return False
+        attack_id = response.json()["attack_gained"]["id"]
+        
+        response = requests.get(f"{base_url}/api/user/attacks", headers=headers, timeout=10)
+        owned = sum(1 for attack in response.json() if attack["id"] == attack_id)
+        
+        attack_data = {
+            "target_username": target_username,
+            "attack_id": attack_id,
+            "target_stat": "sport",
+            "effect_target": "elo"
+        }
+        with ThreadPoolExecutor(max_workers=owned + 3) as pool:
+            responses = list(pool.map(
+                lambda _: requests.post(f"{base_url}/api/user/attack", json=attack_data, headers=headers, timeout=10),
+                range(owned + 3)
+            ))
+        
+        successes = sum(1 for response in responses if response.status_code == 200)
+        print(f"Owned cards: {owned}, successful parallel attacks: {successes}/{len(responses)}")
+        
+        if successes == owned:
+            print("✅ Parallel attacks spent exactly the owned cards")
+            return True
+        else:
+            print("❌ Parallel attacks spent a different number of cards than owned")
+            return False
+            
+    except requests.exceptions.RequestException as e:
+        print(f"❌ Parallel card consumption connection error: {e}")
+        return False
+
+def test_attack_batch(base_url, token, target_username):
+    """Test POST /api/user/attacks/batch per-item results"""
+    print("\n🔍 Testing batch attacks /api/user/attacks/batch...")
+    try:
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        response = requests.post(f"{base_url}/api/user/level-up?stat_name=lecture", headers=headers, timeout=10)
+        if response.status_code != 200:
+            print(f"❌ Level up failed with status {response.status_code}")
+            return False
+        attack_id = response.json()["attack_gained"]["id"]
+        
+        batch = [
+            {"target_username": target_username, "attack_id": attack_id, "target_stat": "lecture", "effect_target": "elo"},
+            {"target_username": f"{target_username}_missing", "attack_id": attack_id, "target_stat": "lecture", "effect_target": "elo"},
+        ]
+        response = requests.post(f"{base_url}/api/user/attacks/batch", json=batch, headers=headers, timeout=10)
+        
+        print(f"Status Code: {response.status_code}")
+        
+        if response.status_code == 200:
+            data = response.json()
+            statuses = [result["status"] for result in data.get("results", [])]
+            print(f"Batch results: {statuses}")
+            if statuses[0] == 200 and statuses[1] in (400, 404) and data.get("sent") == 1:
+                print("✅ Batch attack sent the valid item and reported the invalid one")
+                return True
+            else:
+                print("❌ Unexpected batch attack results")
+                return False
+        else:
+            print(f"❌ Batch attack failed with status {response.status_code}")
+            print(f"Response: {response.text}")
+            return False
+            
+    except requests.exceptions.RequestException as e:
+        print(f"❌ Batch attack connection error: {e}")
+        return False
+
+def test_leaderboard(base_url, token, username):
+    """Test GET /api/leaderboard/{stat} and /api/leaderboard/{stat}/rank/{username}"""
+    print("\n🔍 Testing ELO leaderboards...")
+    try:
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        response = requests.get(f"{base_url}/api/leaderboard/sport", params={"limit": 5}, headers=headers, timeout=10)
+        print(f"Top Status Code: {response.status_code}")
+        if response.status_code != 200:
+            print(f"❌ Leaderboard failed: {response.text}")
+            return False
+        entries = response.json()["entries"]
+        elos = [entry["elo"] for entry in entries]
+        if elos != sorted(elos, reverse=True):
+            print("❌ Leaderboard is not sorted by ELO")
+            return False
+        
+        response = requests.get(f"{base_url}/api/leaderboard/sport/rank/{username}", params={"radius": 2}, headers=headers, timeout=10)
+        print(f"Rank Status Code: {response.status_code}")
+        if response.status_code == 200:
+            data = response.json()
+            if any(entry["username"] == username and entry["rank"] == data["rank"] for entry in data["around"]):
+                print(f"✅ {username} is ranked #{data['rank']} in sport with {len(data['around'])} players around")
+                return True
+            else:
+                print("❌ Rank response does not contain the player")
+                return False
+        else:
+            print(f"❌ Rank lookup failed: {response.text}")
+            return False
+            
+    except requests.exceptions.RequestException as e:
+        print(f"❌ Leaderboard connection error: {e}")
+        return False
+
 def test_friends_system(base_url, token1, token2, username2):
     """Test friends system endpoints"""
     print("\n🔍 Testing friends system...")
@@ -767,6 +1135,110 @@ def test_friends_system(base_url, token1, token2, username2):
         print(f"❌ Friends system connection error: {e}")
         return False
 
+def test_user_cache_consistency(base_url, token):
+    """Test that user_cache serves repeated reads and is invalidated by writes"""
+    print("\n🔍 Testing user cache hits and invalidation...")
+    try:
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        def cache_hits():
+            return requests.get(f"{base_url}/api/cache/stats", timeout=10).json()["users"]["hits"]
+        
+        cards_before = len(requests.get(f"{base_url}/api/user/attacks", headers=headers, timeout=10).json())
+        hits_before = cache_hits()
+        requests.get(f"{base_url}/api/user/attacks", headers=headers, timeout=10)
+        hits_after = cache_hits()
+        if hits_after <= hits_before:
+            print(f"❌ Repeated read did not hit the user cache ({hits_before} -> {hits_after})")
+            return False
+        
+        response = requests.post(
+            f"{base_url}/api/user/level-up",
+            params={"stat_name": "lecture"},
+            headers=headers,
+            timeout=10
+        )
+        if response.status_code != 200:
+            print(f"❌ Level up failed: {response.status_code} - {response.text}")
+            return False
+        
+        cards_after = len(requests.get(f"{base_url}/api/user/attacks", headers=headers, timeout=10).json())
+        if cards_after == cards_before + 1:
+            print("✅ User cache hits on repeated reads and returns fresh data after a write")
+            return True
+        else:
+            print(f"❌ Stale inventory after level up: {cards_before} -> {cards_after} cards")
+            return False
+            
+    except requests.exceptions.RequestException as e:
+        print(f"❌ User cache connection error: {e}")
+        return False
+
+def test_parallel_level_up(base_url, token):
+    """Test that parallel level-ups on one stat are all counted"""
+    print("\n🔍 Testing parallel level-ups...")
+    try:
+        from concurrent.futures import ThreadPoolExecutor
+        headers = {"Authorization": f"Bearer {token}"}
+        parallel = 5
+        
+        response = requests.get(f"{base_url}/api/auth/me", headers=headers, timeout=10)
+        level_before = response.json()["stats"]["creation"]["level"]
+        
+        with ThreadPoolExecutor(max_workers=parallel) as pool:
+            responses = list(pool.map(
+                lambda _: requests.post(f"{base_url}/api/user/level-up", params={"stat_name": "creation"}, headers=headers, timeout=10),
+                range(parallel)
+            ))
+        if any(response.status_code != 200 for response in responses):
+            print(f"❌ Level up failed: {[response.status_code for response in responses]}")
+            return False
+        
+        returned_levels = sorted(response.json()["new_level"] for response in responses)
+        response = requests.get(f"{base_url}/api/auth/me", headers=headers, timeout=10)
+        level_after = response.json()["stats"]["creation"]["level"]
+        print(f"Level: {level_before} -> {level_after}, returned levels: {returned_levels}")
+        
+        expected = list(range(level_before + 1, level_before + parallel + 1))
+        if level_after == level_before + parallel and returned_levels == expected:
+            print("✅ Every parallel level-up was counted")
+            return True
+        else:
+            print("❌ Parallel level-ups overwrote each other")
+            return False
+            
+    except requests.exceptions.RequestException as e:
+        print(f"❌ Parallel level-up connection error: {e}")
+        return False
+
+def test_friends_leaderboard(base_url, token):
+    """Test GET /api/user/friends/leaderboard?stat="""
+    print("\n🔍 Testing friends leaderboard...")
+    try:
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        response = requests.get(f"{base_url}/api/user/friends/leaderboard", params={"stat": "travail"}, headers=headers, timeout=10)
+        
+        print(f"Status Code: {response.status_code}")
+        
+        if response.status_code == 200:
+            entries = response.json()["entries"]
+            elos = [entry["elo"] for entry in entries]
+            if any(entry["is_self"] for entry in entries) and elos == sorted(elos, reverse=True):
+                print(f"✅ Friends leaderboard ranks {len(entries)} players including the user")
+                return True
+            else:
+                print(f"❌ Unexpected friends leaderboard: {entries}")
+                return False
+        else:
+            print(f"❌ Friends leaderboard failed with status {response.status_code}")
+            print(f"Response: {response.text}")
+            return False
+            
+    except requests.exceptions.RequestException as e:
+        print(f"❌ Friends leaderboard connection error: {e}")
+        return False
+
 def test_clubs_system(base_url, token):
     """Test clubs system endpoints"""
     print("\n🔍 Testing clubs system...")
@@ -871,6 +1343,30 @@ def create_second_test_user(base_url):
         print(f"❌ Second user creation error: {e}")
         return False, None, None
 
+def test_clubs_leaderboard(base_url, token):
+    """Test GET /api/clubs/leaderboard (pre-aggregated club_stats)"""
+    print("\n🔍 Testing clubs leaderboard...")
+    try:
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        for params in ({"by": "total_level"}, {"by": "mean_elo", "stat": "sport"}):
+            response = requests.get(f"{base_url}/api/clubs/leaderboard", params=params, headers=headers, timeout=10)
+            print(f"Status Code ({params['by']}): {response.status_code}")
+            if response.status_code != 200:
+                print(f"❌ Clubs leaderboard failed: {response.text}")
+                return False
+            ranks = [club["rank"] for club in response.json()]
+            if ranks != list(range(1, len(ranks) + 1)):
+                print(f"❌ Unexpected club ranks: {ranks}")
+                return False
+        
+        print("✅ Clubs leaderboard served from club_stats")
+        return True
+            
+    except requests.exceptions.RequestException as e:
+        print(f"❌ Clubs leaderboard connection error: {e}")
+        return False
+
 def test_attack_defense_title_system(base_url):
     """Test complete attack, defense and title system"""
     print("\n🎯 Testing Complete Attack, Defense & Title System")
@@ -881,6 +1377,8 @@ def test_attack_defense_title_system(base_url):
     # Test static data endpoints first
     system_results['attacks_list'] = test_attacks_endpoint(base_url)
     system_results['titles_list'] = test_titles_endpoint(base_url)
+    system_results['catalog_caching'] = test_catalog_caching(base_url)
+    system_results['metrics'] = test_metrics_endpoint(base_url)
     
     # Create two test users for interaction testing with unique identifiers
     import time
@@ -947,6 +1445,12 @@ def test_attack_defense_title_system(base_url):
     # Test user-specific endpoints
     system_results['user_attacks'] = test_user_attacks(base_url, token1)
     system_results['user_titles'] = test_user_titles(base_url, token1)
+    system_results['pending_attacks_pagination'] = test_pending_attacks_pagination(base_url, token1)
+    system_results['attack_events_stream'] = test_attack_events_stream(base_url, token1)
+    system_results['active_effects'] = test_active_effects(base_url, token1)
+    system_results['leaderboard'] = test_leaderboard(base_url, token1, username1)
+    system_results['user_cache'] = test_user_cache_consistency(base_url, token1)
+    system_results['parallel_level_up'] = test_parallel_level_up(base_url, token1)
     
     # Test level up system and get an attack
     success, attack_id = test_level_up_system(base_url, token1)
@@ -955,14 +1459,21 @@ def test_attack_defense_title_system(base_url):
     # Test attack system flow if we have two users and an attack
     if token2 and attack_id and username2:
         system_results['attack_flow'] = test_attack_system_flow(base_url, token1, token2, attack_id, username1, username2)
+        system_results['parallel_card_consumption'] = test_parallel_card_consumption(base_url, token1, username2)
+        system_results['attack_batch'] = test_attack_batch(base_url, token1, username2)
         system_results['friends_system'] = test_friends_system(base_url, token1, token2, username2)
+        system_results['friends_leaderboard'] = test_friends_leaderboard(base_url, token1)
     else:
         system_results['attack_flow'] = False
+        system_results['parallel_card_consumption'] = False
+        system_results['attack_batch'] = False
         system_results['friends_system'] = False
+        system_results['friends_leaderboard'] = False
     
     # Test clubs system
     success, club_id = test_clubs_system(base_url, token1)
     system_results['clubs_system'] = success
+    system_results['clubs_leaderboard'] = test_clubs_leaderboard(base_url, token1)
     
     return system_results
 
@@ -993,11 +1504,15 @@ def test_authentication_system(base_url):
     if token and username:
         auth_results['profile'] = test_user_profile(base_url, token, username)
         auth_results['user_search'] = test_user_search(base_url, token, username)
+        auth_results['user_search_ranked'] = test_user_search_ranked(base_url, token, username)
+        auth_results['presence'] = test_presence_heartbeat(base_url, token)
         auth_results['logout'] = test_user_logout(base_url, token)
     else:
         print("❌ No valid token - skipping profile, search, and logout tests")
         auth_results['profile'] = False
         auth_results['user_search'] = False
+        auth_results['user_search_ranked'] = False
+        auth_results['presence'] = False
         auth_results['logout'] = False
     
     return auth_results
@@ -1054,7 +1569,7 @@ def run_all_tests():
     
     # Authentication system tests
     print("\n🔐 AUTHENTICATION SYSTEM TESTS:")
-    auth_tests = ['registration', 'login', 'profile', 'user_search', 'logout']
+    auth_tests = ['registration', 'login', 'profile', 'user_search', 'user_search_ranked', 'presence', 'logout']
     for test_name in auth_tests:
         if test_name in test_results:
             result = test_results[test_name]
@@ -1065,7 +1580,7 @@ def run_all_tests():
     
     # Attack, Defense & Title system tests
     print("\n⚔️  ATTACK, DEFENSE & TITLE SYSTEM TESTS:")
-    system_tests = ['attacks_list', 'titles_list', 'user_attacks', 'user_titles', 'level_up', 'attack_flow', 'friends_system', 'clubs_system']
+    system_tests = ['attacks_list', 'titles_list', 'catalog_caching', 'metrics', 'user_attacks', 'user_titles', 'pending_attacks_pagination', 'attack_events_stream', 'active_effects', 'leaderboard', 'user_cache', 'parallel_level_up', 'level_up', 'attack_flow', 'parallel_card_consumption', 'attack_batch', 'friends_system', 'friends_leaderboard', 'clubs_system', 'clubs_leaderboard']
     for test_name in system_tests:
         if test_name in test_results:
             result = test_results[test_name]
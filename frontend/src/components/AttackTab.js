@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { Card, CardContent, CardHeader, CardTitle } from './ui/card';
 import { Button } from './ui/button';
 import { Badge } from './ui/badge';
@@ -8,6 +8,12 @@ import { Label } from './ui/label';
 import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from './ui/select';
 import { Sword, Target, Zap, Shield, Users, AlertTriangle } from 'lucide-react';
 
+// Ajoute à la liste les attaques absentes (même id), sans doublon
+const mergeAttacks = (list, extra) => {
+  const ids = new Set(list.map((attack) => attack.id));
+  return [...list, ...extra.filter((attack) => !ids.has(attack.id))];
+};
+
 const AttackTab = ({ currentTheme }) => {
   const [userAttacks, setUserAttacks] = useState([]);
   const [allAttacks, setAllAttacks] = useState([]);
@@ -18,12 +24,68 @@ const AttackTab = ({ currentTheme }) => {
   const [effectTarget, setEffectTarget] = useState('elo');
   const [loading, setLoading] = useState(false);
   const [pendingAttacks, setPendingAttacks] = useState([]);
+  // Attaques reçues par le flux pendant un chargement de la liste (null hors chargement)
+  const streamedDuringFetch = useRef(null);
 
-  // Récupérer les attaques disponibles
+  // Récupérer les attaques disponibles (la liste en attente est chargée à l'ouverture du flux)
   useEffect(() => {
     fetchUserAttacks();
     fetchAllAttacks();
-    fetchPendingAttacks();
+  }, []);
+
+  // Attaques reçues en temps réel (SSE) au lieu de relire la liste en boucle
+  useEffect(() => {
+    let events = null;
+    let retryTimer = null;
+    let cancelled = false;
+
+    // Le flux s'ouvre avec un ticket à courte durée : le jeton de session ne passe pas dans l'URL
+    const connect = async () => {
+      const token = localStorage.getItem('token');
+      if (!token) return;
+
+      try {
+        const response = await fetch(`${process.env.REACT_APP_BACKEND_URL}/api/user/attack-events/ticket`, {
+          method: 'POST',
+          headers: {
+            'Authorization': `Bearer ${token}`
+          }
+        });
+        if (!response.ok || cancelled) return;
+        const { ticket } = await response.json();
+        if (cancelled) return;
+
+        events = new EventSource(
+          `${process.env.REACT_APP_BACKEND_URL}/api/user/attack-events?ticket=${encodeURIComponent(ticket)}`
+        );
+        // Flux ouvert (ou rouvert) : charger la liste, les attaques suivantes arrivent par le flux
+        events.addEventListener('open', () => fetchPendingAttacks());
+        events.addEventListener('attack', (event) => {
+          const attack = JSON.parse(event.data);
+          if (streamedDuringFetch.current) streamedDuringFetch.current.push(attack);
+          setPendingAttacks((current) => mergeAttacks(current, [attack]));
+        });
+        // File côté serveur saturée : des événements ont été perdus, on relit la liste
+        events.addEventListener('resync', () => fetchPendingAttacks());
+        // Session expirée : le serveur ferme le flux, on ne le rouvre pas
+        events.addEventListener('expired', () => events.close());
+        // Reconnexion refusée (ticket expiré) : EventSource abandonne, on redemande un ticket
+        events.addEventListener('error', () => {
+          if (events.readyState === EventSource.CLOSED && !cancelled) {
+            retryTimer = setTimeout(connect, 5000);
+          }
+        });
+      } catch (error) {
+        console.error('Erreur lors de l\'ouverture du flux d\'attaques:', error);
+      }
+    };
+
+    connect();
+    return () => {
+      cancelled = true;
+      clearTimeout(retryTimer);
+      if (events) events.close();
+    };
   }, []);
 
   const fetchUserAttacks = async () => {
@@ -60,10 +122,11 @@ const AttackTab = ({ currentTheme }) => {
   };
 
   const fetchPendingAttacks = async () => {
-    try {
-      const token = localStorage.getItem('token');
-      if (!token) return;
+    const token = localStorage.getItem('token');
+    if (!token) return;
 
+    if (!streamedDuringFetch.current) streamedDuringFetch.current = [];
+    try {
       const response = await fetch(`${process.env.REACT_APP_BACKEND_URL}/api/user/pending-attacks`, {
         headers: {
           'Authorization': `Bearer ${token}`,
@@ -73,10 +136,13 @@ const AttackTab = ({ currentTheme }) => {
 
       if (response.ok) {
         const data = await response.json();
-        setPendingAttacks(data);
+        // Garder les attaques arrivées par le flux pendant la requête
+        setPendingAttacks(mergeAttacks(data, streamedDuringFetch.current || []));
       }
     } catch (error) {
       console.error('Erreur lors de la récupération des attaques en attente:', error);
+    } finally {
+      streamedDuringFetch.current = null;
     }
   };
 
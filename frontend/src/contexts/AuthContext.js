@@ -29,6 +29,44 @@ export const AuthProvider = ({ children }) => {
     });
   }, []);
 
+  // Battements de présence tant que l'utilisateur est connecté (statut "en ligne")
+  useEffect(() => {
+    if (!token) return;
+
+    let cancelled = false;
+    let periodSeconds = 30; // remplacé par heartbeat_seconds renvoyé par le serveur
+
+    const sendHeartbeat = async () => {
+      try {
+        const response = await fetch(`${process.env.NEXT_PUBLIC_BACKEND_URL}/api/user/heartbeat`, {
+          method: 'POST',
+          headers: {
+            'Authorization': `Bearer ${token}`,
+            'Content-Type': 'application/json'
+          }
+        });
+        if (cancelled || !response.ok) return;
+        const { heartbeat_seconds } = await response.json();
+        if (!cancelled && heartbeat_seconds && heartbeat_seconds !== periodSeconds) {
+          periodSeconds = heartbeat_seconds;
+          clearInterval(intervalId);
+          intervalId = setInterval(sendHeartbeat, periodSeconds * 1000);
+        }
+      } catch (error) {
+        // L'intervalle continue : le prochain battement réessaiera
+        console.error('Erreur lors de l\'envoi du battement de présence:', error);
+      }
+    };
+
+    let intervalId = setInterval(sendHeartbeat, periodSeconds * 1000);
+    sendHeartbeat();
+
+    return () => {
+      cancelled = true;
+      clearInterval(intervalId);
+    };
+  }, [token]);
+
   const checkAuthStatus = async () => {
     const savedToken = localStorage.getItem('token');
     